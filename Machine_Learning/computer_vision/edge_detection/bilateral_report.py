@@ -0,0 +1,95 @@
+import argparse
+import glob
+import json
+import time
+import numpy as np
+
+from edge_detection import denoise_bilateral
+from util import load_image
+
+"""
+   BILATERAL ERROR REPORT
+
+   Compares the fast bilateral grid filter (denoise_bilateral(...,
+   method='grid')) against the exact filter on the sample images, for a sweep
+   of spatial sigmas and accuracies, and reports per run:
+      - seconds of the exact and of the grid filter, and the speedup
+      - RMSE and largest absolute error of the grid filter (grey levels)
+      - PSNR of the grid filter against the exact filter (peak 255)
+
+   Results are printed as a table and written as JSON.
+"""
+
+"""
+   Errors of an approximate image against a reference image.
+
+   Returns:
+      a dict with 'rmse', 'max_error' and 'psnr' (in dB)
+"""
+def image_errors(approx, exact):
+   diff = approx - exact
+   rmse = float(np.sqrt(np.mean(diff**2)))
+   return {
+      'rmse': rmse,
+      'max_error': float(np.abs(diff).max()),
+      'psnr': float(20 * np.log10(255 / rmse)) if rmse > 0 else float('inf'),
+   }
+
+"""
+   Time the exact and grid bilateral filters on one image.
+
+   Arguments:
+      image       - a 2D numpy array (0-255 grey levels)
+      sigma_s     - spatial gaussian std
+      sigma_r     - range gaussian std
+      accuracies  - accuracies of the grid filter to compare
+
+   Returns:
+      a list of one result dict per accuracy
+"""
+def compare_image(image, sigma_s, sigma_r, accuracies):
+   start = time.perf_counter()
+   exact = denoise_bilateral(image, sigma_s, sigma_r)
+   exact_time = time.perf_counter() - start
+
+   results = []
+   for accuracy in accuracies:
+      start = time.perf_counter()
+      approx = denoise_bilateral(image, sigma_s, sigma_r, method='grid', accuracy=accuracy)
+      grid_time = time.perf_counter() - start
+      result = {
+         'sigma_s': sigma_s,
+         'sigma_r': sigma_r,
+         'accuracy': accuracy,
+         'exact_seconds': exact_time,
+         'grid_seconds': grid_time,
+         'speedup': exact_time / grid_time,
+      }
+      result.update(image_errors(approx, exact))
+      results.append(result)
+   return results
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Compare the bilateral grid filter against the exact filter')
+   parser.add_argument('images', nargs='*', default=['images/*_in.*'], help='images or glob patterns')
+   parser.add_argument('--sigma-s', type=float, nargs='+', default=[1, 3, 6], help='spatial gaussian stds')
+   parser.add_argument('--sigma-r', type=float, default=25.5, help='range gaussian std')
+   parser.add_argument('--accuracy', type=float, nargs='+', default=[1, 2, 3], help='grid accuracies')
+   parser.add_argument('--output', default='bilateral_report.json', help='JSON results file')
+   args = parser.parse_args()
+
+   filenames = [name for pattern in args.images for name in (sorted(glob.glob(pattern)) or [pattern])]
+   report = []
+   print('%-24s%8s%6s%10s%10s%9s%8s%8s%8s' % ('image', 'sigma_s', 'acc', 'exact s', 'grid s', 'speedup', 'rmse', 'max', 'psnr'))
+   for filename in filenames:
+      image = load_image(filename).astype(np.float64)
+      for sigma_s in args.sigma_s:
+         for result in compare_image(image, sigma_s, args.sigma_r, args.accuracy):
+            result['image'] = filename
+            report.append(result)
+            print('%-24s%8g%6g%10.3f%10.3f%9.1f%8.3f%8.2f%8.1f' % (
+               filename, sigma_s, result['accuracy'], result['exact_seconds'], result['grid_seconds'],
+               result['speedup'], result['rmse'], result['max_error'], result['psnr']))
+   with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
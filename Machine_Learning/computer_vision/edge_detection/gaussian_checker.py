@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# gaussian_checker: compare the recursive (IIR) Gaussian of edge_detection.py
+# against its FIR (truncated kernel) Gaussian on the sample images
+import glob
+import time
+import numpy as np
+
+from util import *
+import edge_detection
+
+def is_same(im1, im2, eps=0.1):
+    return np.sum(np.abs(im1 - im2) / np.prod(im1.shape)) <= eps
+
+def print_im_match(im1, im2, eps=0.1):
+    print('Image Match = ' + str(is_same(im1, im2, eps)))
+
+def print_shape_match(im1, im2):
+    print('Shape Match = ' + str(im1.shape == im2.shape))
+
+def print_errors(im1, im2):
+    diff = np.abs(im1 - im2)
+    print('Mean error = %.3f, max error = %.3f' % (diff.mean(), diff.max()))
+
+# largest mean absolute difference (grey levels) allowed between the
+# recursive and the FIR Gaussian
+eps = 2.5
+
+sigmas = [
+    0.5, 1.0, 2.0, 4.0, 8.0, 16.0,
+]
+
+# Test 1
+print('Recursive Gaussian against FIR Gaussian:')
+for filename in sorted(glob.glob('images/*_in.*')):
+    image = load_image(filename).astype(np.float64)
+    print(filename)
+    for sigma in sigmas:
+        start = time.perf_counter()
+        firIm = edge_detection.denoise_gaussian(image, sigma, mode='mirror')
+        firTime = time.perf_counter() - start
+        start = time.perf_counter()
+        recIm = edge_detection.denoise_gaussian(image, sigma, mode='mirror', method='recursive')
+        recTime = time.perf_counter() - start
+        print('Sigma = ' + str(sigma) + ' (fir %.3fs, recursive %.3fs)' % (firTime, recTime))
+        print_shape_match(firIm, recIm)
+        print_im_match(firIm, recIm, eps)
+        print_errors(firIm, recIm)
+print('\n')
+
+# Test 2
+image = load_image('images/image2_in.jpg')
+print('Smoothing and downsampling:')
+for factor in [2, 4]:
+    firIm = edge_detection.smooth_and_downsample(image, factor)
+    recIm = edge_detection.smooth_and_downsample(image, factor, method='recursive')
+    print('Downsample factor = ' + str(factor))
+    print_shape_match(firIm, recIm)
+    print_im_match(firIm, recIm, eps)
+print('\n')
+
+# Test 3
+print('Checking the kernel cache:')
+print('Cached kernel = ' + str(edge_detection.gaussian_1d(1.5) is edge_detection.gaussian_1d(1.5)))
+print('Read-only kernel = ' + str(not edge_detection.gaussian_2d(1.5).flags.writeable))
+print('\n')
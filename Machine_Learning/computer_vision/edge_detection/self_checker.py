@@ -1,7 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # self_checker: compare hw1.py (student version) and hw1_reference (using external libiary)
+#
+# With --benchmark, time the functions of edge_detection.py instead, over a
+# sweep of image sizes and sigmas, check their alternative methods against the
+# baseline methods, and write the results as JSON:
+#
+#   python self_checker.py --benchmark --sizes 256 512 1024 --sigmas 1 3
+import argparse
+import json
+import platform
 import sys
+import time
+import tracemalloc
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -16,59 +27,186 @@ def print_im_match(im1, im2, eps=0.1):
 def print_shape_match(im1, im2):
     print('Shape Match = ' + str(im1.shape == im2.shape))
 
-# import the reference code (master solution)
-# and the student's code
-ref = __import__('hw1_reference')
-student = __import__('hw1')
-
-# image to run tests on
-image = load_image('data/69015.jpg')
-
-# Test 1
-print('Testing convolution:')
-
-kernels = [
-    np.ones([5, 5]),
-]
-
-for kernel in kernels:
-    refIm  = ref.conv_2d(image, kernel.tolist())
-    studentIm = student.conv_2d(image, kernel)
-    studentIm = np.array(studentIm)
-    status = 'Kernel size ' + str(kernel.shape) + '. Match = ' + str(is_same(refIm, studentIm))
-    print(status)
-print('\n')
-
-
-# Test 2
-image = load_image('data/69015.jpg')
-print('Denoise with Gaussian:')
-sigmas = [
-    1.0,
-]
-for sigma in sigmas:
-    refGauss = ref.denoise_gaussian(image, sigma)
-    studentGauss = student.denoise_gaussian(image, sigma)
-    studentGauss = np.array(studentGauss)
-    print('Sigma = ' + str(sigma))
-    print_shape_match(refGauss, studentGauss)
-    print_im_match(refGauss, studentGauss)
-print('\n')
-
-# Test 3
-print('Checking Sobel gradients:')
-refDx, refDy = ref.sobel_gradients(image)
-studentDx, studentDy = student.sobel_gradients(image)
-
-studentDx = np.array(studentDx)
-studentDy = np.array(studentDy)
-
-print('Checking dx:')
-print_shape_match(refDx, studentDx)
-print_im_match(refDx, studentDx)
-
-print('Checking dy:')
-print_shape_match(refDy, studentDy)
-print_im_match(refDy, studentDy)
-
-print('\n')
+def run_checks():
+    # import the reference code (master solution)
+    # and the student's code
+    ref = __import__('hw1_reference')
+    student = __import__('hw1')
+
+    # image to run tests on
+    image = load_image('data/69015.jpg')
+
+    # Test 1
+    print('Testing convolution:')
+
+    kernels = [
+        np.ones([5, 5]),
+    ]
+
+    for kernel in kernels:
+        refIm  = ref.conv_2d(image, kernel.tolist())
+        studentIm = student.conv_2d(image, kernel)
+        studentIm = np.array(studentIm)
+        status = 'Kernel size ' + str(kernel.shape) + '. Match = ' + str(is_same(refIm, studentIm))
+        print(status)
+    print('\n')
+
+
+    # Test 2
+    image = load_image('data/69015.jpg')
+    print('Denoise with Gaussian:')
+    sigmas = [
+        1.0,
+    ]
+    for sigma in sigmas:
+        refGauss = ref.denoise_gaussian(image, sigma)
+        studentGauss = student.denoise_gaussian(image, sigma)
+        studentGauss = np.array(studentGauss)
+        print('Sigma = ' + str(sigma))
+        print_shape_match(refGauss, studentGauss)
+        print_im_match(refGauss, studentGauss)
+    print('\n')
+
+    # Test 3
+    print('Checking Sobel gradients:')
+    refDx, refDy = ref.sobel_gradients(image)
+    studentDx, studentDy = student.sobel_gradients(image)
+
+    studentDx = np.array(studentDx)
+    studentDy = np.array(studentDy)
+
+    print('Checking dx:')
+    print_shape_match(refDx, studentDx)
+    print_im_match(refDx, studentDx)
+
+    print('Checking dy:')
+    print_shape_match(refDy, studentDy)
+    print_im_match(refDy, studentDy)
+
+    print('\n')
+
+# Benchmarked functions: name -> (function of (ed, image, sigma, inputs) to
+# time, whether it depends on sigma).  inputs holds arrays prepared outside
+# the timing (edge strength and direction, nonmax), so that nonmax_suppress
+# and hysteresis_edge_linking are timed alone.
+def benchmarks():
+    box = np.ones([5, 5]) / 25
+    return {
+        'conv_2d': (lambda ed, image, sigma, inputs: ed.conv_2d(image, box), False),
+        'denoise_gaussian': (lambda ed, image, sigma, inputs: ed.denoise_gaussian(image, sigma), True),
+        'denoise_gaussian[recursive]': (lambda ed, image, sigma, inputs: ed.denoise_gaussian(image, sigma, method='recursive'), True),
+        'denoise_bilateral': (lambda ed, image, sigma, inputs: ed.denoise_bilateral(image, sigma), True),
+        'denoise_bilateral[grid]': (lambda ed, image, sigma, inputs: ed.denoise_bilateral(image, sigma, method='grid'), True),
+        'smooth_and_downsample': (lambda ed, image, sigma, inputs: ed.smooth_and_downsample(image), False),
+        'sobel_gradients': (lambda ed, image, sigma, inputs: ed.sobel_gradients(image), False),
+        'nonmax_suppress': (lambda ed, image, sigma, inputs: ed.nonmax_suppress(inputs['mag'], inputs['theta']), True),
+        'hysteresis_edge_linking': (lambda ed, image, sigma, inputs: ed.hysteresis_edge_linking(inputs['nonmax']), True),
+        'canny': (lambda ed, image, sigma, inputs: ed.canny(image, sigma), True),
+        'canny_tiled': (lambda ed, image, sigma, inputs: ed.canny_tiled(image, sigma=sigma, tile_size=256), True),
+    }
+
+# Alternative methods checked against their baseline: name -> (baseline, largest mean
+# absolute difference allowed)
+VARIANTS = {
+    'denoise_gaussian[recursive]': ('denoise_gaussian', 2.5),
+    'denoise_bilateral[grid]': ('denoise_bilateral', 2.5),
+    'canny_tiled': ('canny', 0.0),
+}
+
+# Array compared between an alternative method and its baseline (canny returns mag,
+# nonmax and edge)
+def checked_output(name, output):
+    if name.startswith('canny'):
+        return np.asarray(output[-1] if isinstance(output, tuple) else output, dtype=float)
+    return output
+
+# Square test image of a given size, tiled from a sample image
+def sample_image(filename, size):
+    image = load_image(filename).astype(np.float64)
+    reps = (-(-size // image.shape[0]), -(-size // image.shape[1]))
+    return np.ascontiguousarray(np.tile(image, reps)[:size, :size])
+
+# Best time over repeat calls, then peak traced memory of one more call
+def time_call(call, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = call()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, output
+
+def run_benchmark(filename, sizes, sigmas, repeat, names):
+    import edge_detection as ed
+    table = benchmarks()
+    results = []
+    for size in sizes:
+        image = sample_image(filename, size)
+        for sigma in sigmas:
+            mag, nonmax, _ = ed.canny(image, sigma)
+            dx, dy = ed.sobel_gradients(ed.denoise_gaussian(image, sigma, mode='mirror'), mode='mirror')
+            inputs = {'mag': mag, 'theta': np.arctan2(dy, dx), 'nonmax': nonmax}
+            outputs = {}
+            for name in names:
+                call, uses_sigma = table[name]
+                if not uses_sigma and sigma != sigmas[0]:
+                    continue
+                seconds, peak, output = time_call(lambda: call(ed, image, sigma, inputs), repeat)
+                outputs[name] = output
+                result = {
+                    'function': name,
+                    'size': size,
+                    'sigma': sigma if uses_sigma else None,
+                    'seconds': seconds,
+                    'mp_per_second': image.size / 1e6 / seconds,
+                    'peak_memory_mb': peak / 2**20,
+                }
+                if name in VARIANTS and VARIANTS[name][0] in outputs:
+                    baseline, eps = VARIANTS[name]
+                    fast, slow = checked_output(name, output), checked_output(baseline, outputs[baseline])
+                    result['baseline'] = baseline
+                    result['error'] = float(np.mean(np.abs(fast - slow)))
+                    result['match'] = bool(is_same(fast, slow, eps))
+                results.append(result)
+                match = '' if 'match' not in result else '  Match = ' + str(result['match'])
+                print('%-28s%6d%7s%10.4f%10.2f%10.1f%s' % (name, size, '' if result['sigma'] is None else '%g' % sigma,
+                      seconds, result['mp_per_second'], result['peak_memory_mb'], match))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check edge detection against a reference, or benchmark it')
+    parser.add_argument('--benchmark', action='store_true', help='time edge_detection.py instead of checking hw1.py')
+    parser.add_argument('--image', default='images/image2_in.jpg', help='sample image tiled to every size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 256, 512], help='image sides in pixels')
+    parser.add_argument('--sigmas', type=float, nargs='+', default=[1.0, 3.0], help='sigmas of the sigma-dependent functions')
+    parser.add_argument('--repeat', type=int, default=3, help='calls per measurement; the fastest is reported')
+    parser.add_argument('--functions', nargs='+', default=None, help='functions to benchmark (default: all)')
+    parser.add_argument('--label', default='', help='name of this run in the results')
+    parser.add_argument('--output', default='self_checker.json', help='JSON results file')
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        run_checks()
+        sys.exit(0)
+
+    names = args.functions or list(benchmarks())
+    unknown = [name for name in names if name not in benchmarks()]
+    if unknown:
+        parser.error('unknown functions: ' + ', '.join(unknown))
+    print('%-28s%6s%7s%10s%10s%10s' % ('function', 'size', 'sigma', 'seconds', 'MP/s', 'peak MB'))
+    results = run_benchmark(args.image, args.sizes, args.sigmas, args.repeat, names)
+    run = {
+        'label': args.label,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'image': args.image,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2)
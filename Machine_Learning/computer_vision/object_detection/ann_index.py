@@ -0,0 +1,258 @@
+import argparse
+import time
+import numpy as np
+
+"""
+   APPROXIMATE NEAREST NEIGHBOUR INDEX
+
+   A randomized k-d forest over feature descriptors, written with numpy only.
+
+   Every tree is balanced: each node splits its points at the median of one
+   coordinate, picked at random among the coordinates of highest variance, so
+   a tree of depth D has 2^D leaves of nearly equal size and can be stored as
+   flat arrays in heap order.  A query descends every tree for all query rows
+   at once and compares the query exactly against the points of the leaves
+   it reaches.
+
+   Recall is traded for speed with two knobs:
+      n_trees  - (build time) more trees give more independent partitions
+      n_probes - (query time) leaves visited per tree; probe p > 1 takes the
+                 other branch at the split the query lies closest to
+"""
+
+# Upper bound on the size of the candidate block held in memory while querying
+QUERY_CHUNK_BYTES = 1 << 26
+
+"""
+   Build a randomized k-d forest.
+
+   Arguments:
+      feats      - a numpy array of shape (N, K) of descriptors to index
+      n_trees    - number of trees in the forest
+      leaf_size  - maximum number of points in a leaf
+      top_dims   - number of highest-variance coordinates to draw splits from
+      seed       - seed of the random split choice
+
+   Returns:
+      index      - a dict of numpy arrays describing the forest; it only holds
+                   arrays so it can be saved with np.savez
+"""
+def build_ann_index(feats, n_trees = 4, leaf_size = 32, top_dims = 5, seed = 0):
+   feats = np.asarray(feats, dtype=float)
+   num = feats.shape[0]
+   rng = np.random.default_rng(seed)
+
+   depth = 0
+   while num > leaf_size * 2**depth:
+      depth += 1
+   num_inner = 2**depth - 1
+   max_leaf = -(-num // 2**depth)
+
+   split_dims = np.zeros((n_trees, max(num_inner, 1)), dtype=int)
+   split_values = np.zeros((n_trees, max(num_inner, 1)))
+   leaves = np.full((n_trees, 2**depth, max_leaf), -1, dtype=int)
+
+   for tree in range(n_trees):
+      order = np.arange(num)
+      bounds = [(0, num)]
+      # 1. Split every node of a level at the median of a high-variance coordinate
+      for node in range(num_inner):
+         lo, hi = bounds[node]
+         points = order[lo:hi]
+         variance = feats[points].var(axis=0)
+         dims = np.argsort(-variance, kind='stable')[:top_dims]
+         dim = rng.choice(dims)
+         mid = (hi - lo) // 2
+         values = feats[points, dim]
+         if 0 < mid < hi - lo:
+            part = np.argpartition(values, mid)
+            order[lo:hi] = points[part]
+            values = values[part]
+            split_values[tree, node] = 0.5 * (values[:mid].max() + values[mid])
+         split_dims[tree, node] = dim
+         bounds.append((lo, lo + mid))
+         bounds.append((lo + mid, hi))
+
+      # 2. Store the points of every leaf, padded with -1
+      for leaf, (lo, hi) in enumerate(bounds[num_inner:]):
+         leaves[tree, leaf, :hi - lo] = order[lo:hi]
+
+   return {
+      'feats': feats,
+      'norms': np.einsum('ij,ij->i', feats, feats),
+      'split_dims': split_dims,
+      'split_values': split_values,
+      'leaves': leaves,
+   }
+
+"""
+   Find the leaf reached by every query in one tree.
+
+   Arguments:
+      index      - output of build_ann_index()
+      tree       - index of the tree to descend
+      queries    - a numpy array of shape (Q, K)
+      flip_depth - (optional) numpy array of shape (Q,) giving, per query, the
+                   depth at which to take the other branch
+
+   Returns:
+      leaf       - numpy array of shape (Q,) of leaf indices
+      margins    - numpy array of shape (Q, D) of distances of the query to
+                   the split of the node visited at each depth
+"""
+def descend_tree(index, tree, queries, flip_depth = None):
+   split_dims = index['split_dims'][tree]
+   split_values = index['split_values'][tree]
+   depth = int(np.log2(index['leaves'].shape[1]))
+   rows = np.arange(queries.shape[0])
+
+   node = np.zeros(queries.shape[0], dtype=int)
+   margins = np.zeros((queries.shape[0], depth))
+   for level in range(depth):
+      diff = queries[rows, split_dims[node]] - split_values[node]
+      right = diff >= 0
+      if flip_depth is not None:
+         right ^= flip_depth == level
+      margins[:, level] = np.abs(diff)
+      node = 2*node + 1 + right
+   return node - (2**depth - 1), margins
+
+"""
+   Query a randomized k-d forest for approximate nearest neighbours.
+
+   Arguments:
+      index      - output of build_ann_index()
+      queries    - a numpy array of shape (Q, K)
+      k          - number of neighbours to return
+      n_probes   - number of leaves visited per tree (at most depth + 1)
+
+   Returns:
+      dists      - numpy array of shape (Q, k) of Euclidean distances, sorted
+                   in increasing order (inf where fewer than k points were seen)
+      neighbours - numpy array of shape (Q, k) of indices into the indexed
+                   descriptors (-1 where fewer than k points were seen)
+"""
+def query_ann_index(index, queries, k = 2, n_probes = 1):
+   queries = np.asarray(queries, dtype=float)
+   leaves = index['leaves']
+   n_trees = leaves.shape[0]
+   depth = int(np.log2(leaves.shape[1]))
+   n_probes = min(n_probes, depth + 1)
+
+   # 1. Collect the leaves reached by every query
+   candidates = []
+   for tree in range(n_trees):
+      leaf, margins = descend_tree(index, tree, queries)
+      candidates.append(leaves[tree, leaf])
+      if n_probes > 1:
+         closest = np.argsort(margins, axis=1)
+         for probe in range(1, n_probes):
+            leaf, _ = descend_tree(index, tree, queries, closest[:, probe - 1])
+            candidates.append(leaves[tree, leaf])
+   candidates = np.sort(np.concatenate(candidates, axis=1), axis=1)
+
+   # 2. Compare every query exactly against its candidates, in chunks
+   num = queries.shape[0]
+   dists = np.full((num, k), np.inf)
+   neighbours = np.full((num, k), -1, dtype=int)
+   width = candidates.shape[1]
+   if width == 0:
+      return dists, neighbours
+   chunk = max(1, QUERY_CHUNK_BYTES // (8 * width * queries.shape[1]))
+   for start in range(0, num, chunk):
+      stop = min(start + chunk, num)
+      cand = candidates[start:stop]
+      query = queries[start:stop]
+      dist = index['norms'][cand] - 2 * np.einsum('qk,qck->qc', query, index['feats'][cand])
+      dist += np.einsum('ij,ij->i', query, query)[:, None]
+
+      # 3. Ignore padding and points seen in more than one tree or probe
+      repeated = np.zeros(cand.shape, dtype=bool)
+      repeated[:, 1:] = cand[:, 1:] == cand[:, :-1]
+      dist[repeated | (cand < 0)] = np.inf
+
+      # 4. Keep the k nearest candidates
+      kk = min(k, width)
+      top = np.argpartition(dist, kk - 1, axis=1)[:, :kk] if kk < width else np.argsort(dist, axis=1)
+      top = np.take_along_axis(top, np.argsort(np.take_along_axis(dist, top, axis=1), axis=1), axis=1)
+      found = np.take_along_axis(dist, top, axis=1)
+      dists[start:stop, :kk] = np.sqrt(np.maximum(found, 0))
+      neighbours[start:stop, :kk] = np.where(np.isinf(found), -1, np.take_along_axis(cand, top, axis=1))
+
+   return dists, neighbours
+
+"""
+   Recall and latency of approximate matching against the exact matcher.
+
+   For each (n_trees, n_probes) setting, builds an index over feats1, matches
+   feats0 against it and reports the build and query time, the speedup over
+   exact matching, the fraction of rows whose nearest neighbour agrees with
+   the exact matcher (recall) and the mean absolute error of the ratio score.
+
+   Arguments:
+      feats0     - a numpy array of shape (N0, K) of query descriptors
+      feats1     - a numpy array of shape (N1, K) of indexed descriptors
+      settings   - list of (n_trees, n_probes) pairs
+      leaf_size  - leaf size of every index
+
+   Returns:
+      rows       - a list of dicts, one per setting
+"""
+def recall_report(feats0, feats1, settings, leaf_size = 32):
+   from object_detection import match_features
+
+   start = time.perf_counter()
+   exact_matches, exact_scores = match_features(feats0, feats1, None, None)
+   exact_time = time.perf_counter() - start
+
+   rows = []
+   for n_trees, n_probes in settings:
+      start = time.perf_counter()
+      index = build_ann_index(feats1, n_trees=n_trees, leaf_size=leaf_size)
+      build_time = time.perf_counter() - start
+
+      start = time.perf_counter()
+      matches, scores = match_features(feats0, feats1, None, None, index=index, n_probes=n_probes)
+      query_time = time.perf_counter() - start
+
+      rows.append({
+         'n_trees': n_trees,
+         'n_probes': n_probes,
+         'build_s': build_time,
+         'query_s': query_time,
+         'exact_s': exact_time,
+         'speedup': exact_time / query_time,
+         'recall': float(np.mean(matches == exact_matches)),
+         'score_error': float(np.mean(np.abs(scores - exact_scores))),
+      })
+   return rows
+
+"""
+   Synthetic descriptors resembling orientation histograms: non-negative
+   vectors drawn around a set of cluster centres, with queries that are
+   noisy copies of indexed descriptors.
+"""
+def synthetic_descriptors(num0, num1, dim = 72, clusters = 64, noise = 0.1, seed = 0):
+   rng = np.random.default_rng(seed)
+   centres = rng.gamma(1.0, 1.0, size=(clusters, dim))
+   feats1 = centres[rng.integers(clusters, size=num1)] + rng.gamma(1.0, 0.5, size=(num1, dim))
+   source = rng.integers(num1, size=num0)
+   feats0 = feats1[source] * rng.normal(1.0, noise, size=(num0, dim))
+   return np.maximum(feats0, 0), feats1
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Recall vs latency of the ANN index against exact matching')
+   parser.add_argument('--queries', type=int, default=5000)
+   parser.add_argument('--points', type=int, default=20000)
+   parser.add_argument('--noise', type=float, default=0.1)
+   parser.add_argument('--leaf-size', type=int, default=32)
+   args = parser.parse_args()
+
+   feats0, feats1 = synthetic_descriptors(args.queries, args.points, noise=args.noise)
+   settings = [(1, 1), (2, 1), (4, 1), (4, 2), (8, 2), (8, 4), (16, 4)]
+   print('trees probes   build(s)  query(s)  exact(s)  speedup  recall  score_err')
+   for row in recall_report(feats0, feats1, settings, args.leaf_size):
+      print('%5d %6d %10.3f %9.3f %9.3f %8.1f %7.3f %10.4f' % (
+         row['n_trees'], row['n_probes'], row['build_s'], row['query_s'],
+         row['exact_s'], row['speedup'], row['recall'], row['score_error']))
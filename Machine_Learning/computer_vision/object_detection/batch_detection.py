@@ -0,0 +1,150 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from collections import deque
+from multiprocessing import Pool, resource_tracker, shared_memory
+import numpy as np
+
+from object_detection import build_template_index, object_detection
+from util import load_image, load_templates
+
+"""
+   BATCH OBJECT DETECTION
+
+   Runs object_detection over a collection of test images on a process pool.
+
+   Every worker builds the template index once, when it starts.  Test images
+   given as file names are loaded by the workers themselves; images given as
+   arrays are copied once into shared memory and read by the worker in place,
+   so no pixel data is pickled.  At most max_pending images are in flight at
+   a time, which bounds the shared memory in use, and results are yielded in
+   input order as soon as they are ready.
+"""
+
+# Template index of the templates the worker was started with
+worker_template_index = None
+
+def init_worker(template_images, template_masks):
+   global worker_template_index
+   worker_template_index = build_template_index(template_images, template_masks)
+
+"""
+   Detect the object in one test image inside a worker.
+
+   Arguments:
+      task  - ('path', filename) or ('shm', (name, shape, dtype)) for an image
+              stored in a shared memory block
+
+   Returns:
+      bbox  - output of object_detection()
+"""
+def detect_task(task):
+   kind, payload = task
+   if kind == 'path':
+      bbox = object_detection(None, None, load_image(payload), template_index=worker_template_index)
+   else:
+      name, shape, dtype = payload
+      block = shared_memory.SharedMemory(name=name)
+      try:
+         image = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+         bbox = object_detection(None, None, image, template_index=worker_template_index)
+         del image
+      finally:
+         block.close()
+   return tuple(float(value) for value in bbox)
+
+"""
+   Copy an image into a new shared memory block.
+
+   Returns:
+      block - the shared memory block (the caller must unlink it)
+      task  - the task describing the image for detect_task()
+"""
+def share_image(image):
+   image = np.ascontiguousarray(image)
+   block = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+   np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+   return block, ('shm', (block.name, image.shape, image.dtype.str))
+
+"""
+   Detect the object in every image of a collection.
+
+   Arguments:
+      images          - a glob pattern, or an iterable of file names and/or
+                        2D numpy arrays (grayscale test images)
+      template_images - a list of gray scale template images
+      template_masks  - a list of binary masks of the template images
+      processes       - number of worker processes (default: number of CPUs)
+      max_pending     - maximum number of images in flight (default: 4 per
+                        worker)
+
+   Returns:
+      a generator of bounding boxes (x_min, y_min, x_max, y_max), one per
+      image, in the order of the images
+"""
+def detect_batch(images, template_images, template_masks, processes = None, max_pending = None):
+   if isinstance(images, str):
+      images = sorted(glob.glob(images))
+
+   if processes is None:
+      processes = os.cpu_count() or 1
+   if max_pending is None:
+      max_pending = 4 * processes
+
+   # Start the resource tracker before forking so that the workers share it
+   # instead of each tracking (and unlinking at exit) the blocks they attach to
+   resource_tracker.ensure_running()
+
+   with Pool(processes, initializer=init_worker, initargs=(template_images, template_masks)) as pool:
+      pending = deque()
+      try:
+         for image in images:
+            if isinstance(image, str):
+               block, task = None, ('path', image)
+            else:
+               block, task = share_image(image)
+            pending.append((pool.apply_async(detect_task, (task,)), block))
+
+            # Hand back finished results in order once the window is full
+            while len(pending) >= max_pending:
+               yield finish(pending.popleft())
+
+         while pending:
+            yield finish(pending.popleft())
+      finally:
+         for _, block in pending:
+            if block is not None:
+               block.close()
+               block.unlink()
+
+def finish(entry):
+   result, block = entry
+   try:
+      return result.get()
+   finally:
+      if block is not None:
+         block.close()
+         block.unlink()
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Detect an object category in a collection of images')
+   parser.add_argument('templates', help='.mat file with template_images and template_masks')
+   parser.add_argument('images', nargs='+', help='test images or glob patterns')
+   parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+   parser.add_argument('--output', default=None, help='JSON lines output file (default: stdout)')
+   args = parser.parse_args()
+
+   template_images, template_masks = load_templates(args.templates)
+   filenames = [name for pattern in args.images for name in (sorted(glob.glob(pattern)) or [pattern])]
+
+   output = open(args.output, 'w') if args.output else sys.stdout
+   try:
+      for filename, bbox in zip(filenames, detect_batch(filenames, template_images, template_masks, args.processes)):
+         output.write(json.dumps({'image': filename, 'bbox': [float(value) for value in bbox]}) + '\n')
+         output.flush()
+   finally:
+      if output is not sys.stdout:
+         output.close()
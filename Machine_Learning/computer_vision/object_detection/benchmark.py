@@ -0,0 +1,291 @@
+import argparse
+import json
+import platform
+import resource
+import time
+import tracemalloc
+import numpy as np
+from numpy import pi
+
+from object_detection import DESCRIPTORS, build_template_index, find_interest_points, gradient_features, image_orientation, locate_templates, object_detection, orientation_to_index, peaks_to_bbox
+from profiling import DetectionProfile
+from util import load_dataset, compute_iou
+
+"""
+   OBJECT DETECTION BENCHMARK
+
+   Runs the detector on every test image of the bundled datasets
+   (data_car.mat, data_cup.mat) and reports, per dataset:
+      - wall time of every stage (Harris, descriptors, matching, Hough)
+        summed over the test images, and of enrolling the templates
+      - images per second, and the detection time of every image
+      - peak memory allocated by numpy and Python during detection
+      - mean IoU of the predicted boxes against the ground truth
+
+   Results are written as JSON so that runs of different versions or engines
+   can be compared with --compare.
+
+   With --check-precision the float32 pipeline is instead compared against
+   the float64 pipeline image by image, and the run fails if the differences
+   exceed PRECISION_TOLERANCES.  Orientations, descriptors and boxes are
+   compared over stable pixels only (see stable_pixels).
+"""
+
+STAGES = ('harris', 'descriptors', 'matching', 'hough')
+
+DTYPES = {'float32': np.float32, 'float64': np.float64}
+
+# Largest differences allowed between the float32 and float64 pipelines:
+#   keypoint_loss      - fraction of float64 interest points missing in float32
+#   score_error        - error of Harris scores relative to the largest score
+#   orientation_error  - fraction of stable pixels in another orientation bin
+#   descriptor_error   - relative L2 error of the stable descriptors of an image
+#   bbox_error         - distance in pixels between the boxes detected from
+#                        stable descriptors
+PRECISION_TOLERANCES = {
+   'keypoint_loss': 0.01,
+   'score_error': 1e-5,
+   'orientation_error': 1e-4,
+   'descriptor_error': 1e-6,
+   'bbox_error': 1.0,
+}
+
+# Distance (radians) to an orientation bin edge, and magnitude relative to the
+# largest of the image, below which a pixel's orientation bin is left to
+# rounding noise
+STABLE_TOLERANCE = 1e-3
+
+"""
+   Pixels whose orientation bin does not depend on rounding.
+
+   The orientation bin of a pixel is decided by rounding noise alone when its
+   orientation is on a bin edge: a multiple of pi/4, including +-pi/2 where dx
+   is close to zero (whose sign picks the bin) and 0 where dx is exactly zero.
+   The same holds for pixels of negligible gradient.  Perturbing a float64
+   image by 1e-12 already moves such pixels between bins, and the detected
+   box with them, so the float32 pipeline can only be compared with the
+   float64 one away from these pixels.
+
+   Arguments:
+      image    - a grayscale image; the float64 gradients decide the pixels
+
+   Returns:
+      stable   - a boolean array of the shape of image
+"""
+def stable_pixels(image):
+   theta, mag = image_orientation(np.asarray(image, dtype=np.float64))
+   edge = np.rint(theta / (pi/4)) * (pi/4)
+   return (np.abs(theta - edge) > STABLE_TOLERANCE) & (mag > STABLE_TOLERANCE * mag.max(initial=0))
+
+"""
+   Histogram descriptors of an image computed over its stable pixels only
+   (the gradient magnitude of the other pixels is set to zero).
+"""
+def stable_features(image, xs, ys):
+   theta, mag = image_orientation(image)
+   return gradient_features(theta, mag * stable_pixels(image), xs, ys)
+
+"""
+   A template index whose descriptors are replaced by stable_features() of
+   the same templates at the same interest points.
+"""
+def stable_index(index, template_images, template_masks, dtype):
+   feats = []
+   for t, (template_image, template_mask) in enumerate(zip(template_images, template_masks)):
+      rows = slice(index['offsets'][t], index['offsets'][t+1])
+      template_img = (template_image * template_mask).astype(dtype, copy=False)
+      feats.append(stable_features(template_img, index['xs'][rows], index['ys'][rows]))
+   return dict(index, feats=np.concatenate(feats))
+
+"""
+   Bounding box detected in an image from its stable descriptors.
+"""
+def stable_bbox(index, image):
+   xs, ys, scores = find_interest_points(image)
+   peaks = locate_templates(index, xs, ys, scores, stable_features(image, xs, ys))
+   return np.array(peaks_to_bbox(index, peaks), dtype=float)
+
+"""
+   Benchmark the detector on one dataset.
+
+   Arguments:
+      filename - .mat dataset (see util.load_dataset)
+      repeat   - number of timed passes over the test images; stage times are
+                 the fastest pass (peak memory is measured in a separate pass)
+      dtype    - floating point type to run the pipeline in
+      descriptor - feature descriptor (see object_detection.DESCRIPTORS)
+
+   Returns:
+      result   - a dict of metrics (see the module description)
+"""
+def run_dataset(filename, repeat = 1, dtype = np.float64, descriptor = 'histogram'):
+   template_images, template_masks, test_images, targets = load_dataset(filename, dtype)
+
+   start = time.perf_counter()
+   template_index = build_template_index(template_images, template_masks, descriptor=descriptor)
+   enroll_time = time.perf_counter() - start
+
+   # 1. Timed passes, without tracemalloc (it slows allocations down)
+   best = None
+   for _ in range(repeat):
+      profile = DetectionProfile()
+      boxes = []
+      image_times = []
+      for test_img in test_images:
+         start = time.perf_counter()
+         bbox = object_detection(None, None, test_img, template_index=template_index, profile=profile)
+         image_times.append(time.perf_counter() - start)
+         boxes.append([float(value) for value in bbox])
+      total = sum(image_times)
+      totals = profile.totals()
+      stage_times = {stage: totals.get(stage, 0.0) for stage in STAGES}
+      if best is None or total < best[0]:
+         best = (total, stage_times, boxes, image_times)
+   total, stage_times, boxes, image_times = best
+
+   # 2. Peak memory of one more, untimed pass
+   tracemalloc.start()
+   for test_img in test_images:
+      object_detection(None, None, test_img, template_index=template_index)
+   peak = tracemalloc.get_traced_memory()[1]
+   tracemalloc.stop()
+   ious = [float(compute_iou(box, target)) for box, target in zip(boxes, targets)]
+   return {
+      'dataset': filename,
+      'dtype': np.dtype(dtype).name,
+      'descriptor': descriptor,
+      'images': len(test_images),
+      'templates': len(template_images),
+      'enroll_seconds': enroll_time,
+      'total_seconds': total,
+      'images_per_second': len(test_images) / total,
+      'stage_seconds': stage_times,
+      'peak_memory_mb': peak / 2**20,
+      'mean_iou': float(np.mean(ious)),
+      'iou': ious,
+      'boxes': boxes,
+      'image_seconds': image_times,
+   }
+
+"""
+   Compare the float32 pipeline against the float64 pipeline on one dataset.
+
+   Interest points and scores are compared on every test image, as are the
+   orientation bins and descriptors of stable pixels (descriptors at the
+   float64 interest points, so that both describe the same locations) and the
+   bounding boxes detected from stable descriptors.
+
+   Arguments:
+      filename   - .mat dataset (see util.load_dataset)
+      tolerances - largest differences allowed (see PRECISION_TOLERANCES)
+
+   Returns:
+      result     - a dict with the largest difference of every metric over
+                   the images, the per-image differences and 'passed'
+"""
+def check_precision(filename, tolerances = PRECISION_TOLERANCES):
+   template_images, template_masks, test_images, _ = load_dataset(filename, np.float64)
+   index64 = build_template_index(template_images, template_masks, dtype=np.float64)
+   index32 = build_template_index(template_images, template_masks, dtype=np.float32)
+   index64 = stable_index(index64, template_images, template_masks, np.float64)
+   index32 = stable_index(index32, template_images, template_masks, np.float32)
+
+   images = []
+   for test_img in test_images:
+      test_img32 = test_img.astype(np.float32)
+      xs64, ys64, scores64 = find_interest_points(test_img)
+      xs32, ys32, scores32 = find_interest_points(test_img32)
+      found = set(zip(xs32.tolist(), ys32.tolist()))
+      missing = sum((x, y) not in found for x, y in zip(xs64.tolist(), ys64.tolist()))
+      n = min(len(scores64), len(scores32))
+      score_scale = max(float(np.abs(scores64).max(initial=0)), np.finfo(float).tiny)
+
+      stable = stable_pixels(test_img)
+      bins64 = orientation_to_index(image_orientation(test_img)[0][stable])
+      bins32 = orientation_to_index(image_orientation(test_img32)[0][stable])
+
+      feats64 = stable_features(test_img, xs64, ys64)
+      feats32 = stable_features(test_img32, xs64, ys64)
+      feats_norm = max(float(np.linalg.norm(feats64)), np.finfo(float).tiny)
+
+      bbox64 = stable_bbox(index64, test_img)
+      bbox32 = stable_bbox(index32, test_img32)
+
+      images.append({
+         'keypoint_loss': missing / max(len(xs64), 1),
+         'score_error': float(np.abs(np.sort(scores64)[::-1][:n] - np.sort(scores32)[::-1][:n]).max(initial=0)) / score_scale,
+         'orientation_error': float(np.mean(bins64 != bins32)) if bins64.size else 0.0,
+         'descriptor_error': float(np.linalg.norm(feats64 - feats32)) / feats_norm,
+         'bbox_error': float(np.abs(bbox64 - bbox32).max()),
+      })
+
+   worst = {key: max((image[key] for image in images), default=0.0) for key in tolerances}
+   return {
+      'dataset': filename,
+      'max_error': worst,
+      'tolerances': dict(tolerances),
+      'passed': all(worst[key] <= tolerances[key] for key in tolerances),
+      'images': images,
+   }
+
+"""
+   Print the results of several benchmark runs side by side.
+"""
+def compare(runs):
+   names = [run.get('label') or str(i) for i, run in enumerate(runs)]
+   print('%-28s' % 'metric' + ''.join('%16s' % name for name in names))
+   datasets = [result['dataset'] for result in runs[0]['results']]
+   for dataset in datasets:
+      print(dataset)
+      rows = [('images/s', 'images_per_second'), ('total s', 'total_seconds'),
+              ('enroll s', 'enroll_seconds'), ('peak MB', 'peak_memory_mb'), ('mean IoU', 'mean_iou')]
+      rows += [(stage + ' s', stage) for stage in STAGES]
+      for title, key in rows:
+         values = []
+         for run in runs:
+            result = next((r for r in run['results'] if r['dataset'] == dataset), None)
+            if result is None:
+               values.append('%16s' % '-')
+            else:
+               value = result['stage_seconds'][key] if key in STAGES else result[key]
+               values.append('%16.4f' % value)
+         print('  %-26s' % title + ''.join(values))
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Benchmark speed and accuracy of object detection')
+   parser.add_argument('datasets', nargs='*', default=['data_car.mat', 'data_cup.mat'])
+   parser.add_argument('--repeat', type=int, default=1, help='passes over the test images')
+   parser.add_argument('--label', default='', help='name of this run in the results')
+   parser.add_argument('--output', default='benchmark.json', help='JSON results file')
+   parser.add_argument('--compare', nargs='+', metavar='JSON', help='compare earlier results instead of running')
+   parser.add_argument('--dtype', choices=sorted(DTYPES), default='float64', help='floating point type of the pipeline')
+   parser.add_argument('--descriptor', choices=sorted(DESCRIPTORS), default='histogram', help='feature descriptor')
+   parser.add_argument('--check-precision', action='store_true', help='compare the float32 and float64 pipelines instead of timing')
+   args = parser.parse_args()
+
+   if args.compare:
+      compare([json.load(open(name)) for name in args.compare])
+   elif args.check_precision:
+      checks = [check_precision(dataset) for dataset in args.datasets]
+      with open(args.output, 'w') as f:
+         json.dump({'label': args.label, 'precision': checks}, f, indent=2)
+      for check in checks:
+         print(check['dataset'], 'passed' if check['passed'] else 'FAILED')
+         for key, value in check['max_error'].items():
+            print('  %-26s%12.3g  (tolerance %g)' % (key, value, check['tolerances'][key]))
+      if not all(check['passed'] for check in checks):
+         raise SystemExit(1)
+   else:
+      results = [run_dataset(dataset, args.repeat, DTYPES[args.dtype], args.descriptor) for dataset in args.datasets]
+      run = {
+         'label': args.label,
+         'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+         'python': platform.python_version(),
+         'numpy': np.__version__,
+         'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+         'results': results,
+      }
+      with open(args.output, 'w') as f:
+         json.dump(run, f, indent=2)
+      compare([run])
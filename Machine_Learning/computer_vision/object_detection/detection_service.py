@@ -0,0 +1,127 @@
+import argparse
+import base64
+import io
+import json
+import os
+import socketserver
+import sys
+import time
+import numpy as np
+
+from object_detection import DESCRIPTORS, build_template_index, object_detection
+from profiling import DetectionProfile
+from util import load_image, load_templates, rgb2gray
+
+"""
+   DETECTION SERVICE
+
+   Long-running detector that loads a template library and builds its index
+   once, then answers detection requests, so that neither the imports nor the
+   template features are paid for per image.
+
+   Requests and responses are JSON objects, one per line, read from stdin (or
+   from the connections of a local socket) and answered in order:
+
+      {"id": 1, "path": "images/img1.png"}
+      {"id": 2, "buffer": "<base64 pixels>", "shape": [240, 320], "dtype": "uint8"}
+
+      {"id": 1, "bbox": [x_min, y_min, x_max, y_max],
+       "timings": {"load": 0.004, "harris": 0.05, ..., "total": 0.12}}
+
+   Raw buffers hold the pixels of a grayscale (H, W) or color (H, W, 3|4)
+   image in row-major order; integer pixels are scaled like load_image().
+   A request that fails is answered with {"id": ..., "error": "..."} and the
+   service keeps running.
+"""
+class DetectionService:
+   def __init__(self, template_images, template_masks, dtype = None, descriptor = 'histogram'):
+      self.dtype = dtype
+      self.template_index = build_template_index(template_images, template_masks, dtype=dtype, descriptor=descriptor)
+
+   # Decode the test image of a request
+   def load(self, request):
+      if 'path' in request:
+         return load_image(request['path'], self.dtype or np.float64)
+      buffer = base64.b64decode(request['buffer'])
+      image = np.frombuffer(buffer, dtype=request.get('dtype', 'uint8')).reshape(request['shape'])
+      if np.issubdtype(image.dtype, np.integer):
+         image = image / 255
+      if image.ndim == 3:
+         image = rgb2gray(image)
+      return image.astype(self.dtype or np.float64, copy=False)
+
+   # Answer one request (a dict) with a response dict
+   def handle(self, request):
+      response = {'id': request.get('id')} if isinstance(request, dict) else {'id': None}
+      start = time.perf_counter()
+      try:
+         image = self.load(request)
+         loaded = time.perf_counter()
+         profile = DetectionProfile()
+         bbox = object_detection(None, None, image, template_index=self.template_index, profile=profile)
+      except Exception as error:
+         response['error'] = '%s: %s' % (type(error).__name__, error)
+         return response
+      timings = {'load': loaded - start}
+      timings.update(profile.totals())
+      timings['total'] = time.perf_counter() - start
+      response['bbox'] = [float(value) for value in bbox]
+      response['timings'] = timings
+      return response
+
+   # Answer the JSON lines of a text stream until it ends
+   def serve_lines(self, lines, output):
+      for line in lines:
+         if not line.strip():
+            continue
+         try:
+            request = json.loads(line)
+         except ValueError as error:
+            response = {'id': None, 'error': 'invalid JSON: %s' % error}
+         else:
+            response = self.handle(request)
+         output.write(json.dumps(response) + '\n')
+         output.flush()
+
+"""
+   Serve a detection service on a local (Unix domain) socket until
+   interrupted.  Every connection is a JSON lines stream as on stdin, and
+   connections are served concurrently; the template index is only read.
+
+   Arguments:
+      service - a DetectionService
+      path    - file name of the socket
+"""
+def serve_socket(service, path):
+   class Handler(socketserver.StreamRequestHandler):
+      def handle(self):
+         lines = io.TextIOWrapper(self.rfile, encoding='utf-8')
+         output = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+         service.serve_lines(lines, output)
+
+   if os.path.exists(path):
+      os.unlink(path)
+   with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+      try:
+         server.serve_forever()
+      finally:
+         os.unlink(path)
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Serve object detection requests as JSON lines')
+   parser.add_argument('templates', help='.mat file with template_images and template_masks')
+   parser.add_argument('--socket', default=None, help='serve on this Unix socket instead of stdin/stdout')
+   parser.add_argument('--dtype', choices=['float32', 'float64'], default='float64', help='floating point type of the pipeline')
+   parser.add_argument('--descriptor', choices=sorted(DESCRIPTORS), default='histogram', help='feature descriptor')
+   args = parser.parse_args()
+
+   template_images, template_masks = load_templates(args.templates)
+   service = DetectionService(template_images, template_masks, np.dtype(args.dtype).type, args.descriptor)
+   try:
+      if args.socket:
+         serve_socket(service, args.socket)
+      else:
+         service.serve_lines(sys.stdin, sys.stdout)
+   except KeyboardInterrupt:
+      pass
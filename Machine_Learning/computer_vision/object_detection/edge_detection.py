@@ -0,0 +1,1159 @@
+import os
+import tempfile
+from functools import lru_cache, partial
+from multiprocessing import Pool
+import numpy as np
+
+"""
+   Pad an image with zeros along its border.
+
+   Arguments:
+      image - a 2D numpy array
+      wx    - rows of padding above and below the image (or a (before, after)
+              pair)
+      wy    - columns of padding left and right of the image (or a pair)
+
+   Returns:
+      img   - the padded image
+"""
+def pad_border(image, wx = 1, wy = 1):
+   assert image.ndim == 2, 'image should be grayscale'
+   return np.pad(image, (np.broadcast_to(wx, 2), np.broadcast_to(wy, 2)))
+
+"""
+   Remove the border of an image.
+
+   Arguments:
+      image - a 2D numpy array
+      wx    - rows to remove from the top and the bottom
+      wy    - columns to remove from the left and the right
+
+   Returns:
+      img   - the trimmed image
+"""
+def trim_border(image, wx = 1, wy = 1):
+   assert image.ndim == 2, 'image should be grayscale'
+   sx, sy = image.shape
+   return image[wx:(sx-wx), wy:(sy-wy)]
+
+"""
+   Extend an image by mirroring it about its border (the border pixels are
+   repeated).
+
+   Arguments:
+      image - a 2D numpy array
+      wx    - rows of mirrored image above and below (or a (before, after) pair)
+      wy    - columns of mirrored image left and right (or a pair)
+
+   Returns:
+      img   - the extended image
+"""
+def mirror_border(image, wx = 1, wy = 1):
+   assert image.ndim == 2, 'image should be grayscale'
+   return np.pad(image, (np.broadcast_to(wx, 2), np.broadcast_to(wy, 2)), mode='symmetric')
+
+"""
+   Floating point type of filter outputs: float32 images are filtered in
+   float32, anything else in float64.
+"""
+def filter_dtype(image):
+   return np.float32 if image.dtype == np.float32 else np.float64
+
+"""
+   Factor a rank-1 filter into a column and a row.
+
+   The factors are taken from the row and the column of the largest entry,
+   so integer filters such as the Sobel operators factor exactly.
+
+   Arguments:
+      filt     - a 2D numpy array
+
+   Returns:
+      col, row - 1D numpy arrays with filt == outer(col, row), or None if the
+                 filter is not separable
+"""
+def separate_filter(filt):
+   i, j = np.unravel_index(np.argmax(np.abs(filt)), filt.shape)
+   if filt[i, j] == 0:
+      return None
+   col = filt[:, j]
+   row = filt[i, :] / filt[i, j]
+   scale = np.abs(filt).max()
+   if np.abs(np.outer(col, row) - filt).max() > 1e-12 * scale:
+      return None
+   return col, row
+
+# Cost of an FFT convolution per element and log2 of the transform size, in
+# units of one filter tap over one pixel of a shifted sum (measured)
+FFT_COST = 1.25
+
+"""
+   Smallest length >= n whose only prime factors are 2, 3 and 5, for which
+   the FFT is fast.
+"""
+def fft_size(n):
+   best = 1 << int(np.ceil(np.log2(max(n, 1))))
+   power5 = 1
+   while power5 < best:
+      power35 = power5
+      while power35 < best:
+         size = power35
+         while size < n:
+            size *= 2
+         best = min(best, size)
+         power35 *= 3
+      power5 *= 5
+   return best
+
+"""
+   Correlate a padded image with a filter by summing shifted copies of the
+   image, one per nonzero tap.
+
+   Arguments:
+      padded - a 2D numpy array extended by (kh-1, kw-1) pixels around the
+               output (or a stack of them along leading axes)
+      filt   - a 2D numpy array (kh, kw)
+      dtype  - floating point type of the result
+
+   Returns:
+      out    - the 'valid' correlation, of shape padded.shape - filt.shape + 1
+"""
+def correlate_shifted(padded, filt, dtype):
+   kh, kw = filt.shape
+   sx, sy = padded.shape[-2] - kh + 1, padded.shape[-1] - kw + 1
+   out = np.zeros(padded.shape[:-2] + (sx, sy), dtype=dtype)
+   for a, b in zip(*np.nonzero(filt)):
+      weight = dtype(filt[a, b])
+      if weight == 1:
+         out += padded[..., a:a+sx, b:b+sy]
+      else:
+         out += weight * padded[..., a:a+sx, b:b+sy]
+   return out
+
+"""
+   Correlate a padded image with a filter through the FFT.  Same arguments
+   and result as correlate_shifted().
+"""
+def correlate_fft(padded, filt, dtype):
+   kh, kw = filt.shape
+   sx, sy = padded.shape[0] - kh + 1, padded.shape[1] - kw + 1
+   shape = (fft_size(padded.shape[0]), fft_size(padded.shape[1]))
+   spectrum = np.fft.rfft2(padded, shape) * np.fft.rfft2(filt[::-1, ::-1], shape)
+   out = np.fft.irfft2(spectrum, shape)
+   return out[kh-1:kh-1+sx, kw-1:kw-1+sy].astype(dtype, copy=False)
+
+"""
+   Estimated cost of each convolution method for an image and a filter.
+
+   Returns:
+      a dict mapping 'shifted', 'fft' and (for rank-1 filters) 'separable' to
+      an estimated number of multiply-adds
+"""
+def conv_costs(image_shape, filt, factors = None):
+   sx, sy = image_shape
+   kh, kw = filt.shape
+   size = fft_size(sx + kh - 1) * fft_size(sy + kw - 1)
+   costs = {
+      'shifted': np.count_nonzero(filt) * sx * sy,
+      'fft': FFT_COST * size * np.log2(max(size, 2)),
+   }
+   if factors is not None:
+      col, row = factors
+      costs['separable'] = (np.count_nonzero(col) * (sy + kw - 1) + np.count_nonzero(row) * sy) * sx
+   return costs
+
+"""
+   CONVOLUTION
+
+   Convolve an image with a 2D filter.  The result has the size of the image:
+   result[i, j] = sum over (a, b) of filt[a, b] * image[i + cx - a, j + cy - b]
+   with cx = (kh-1)//2 and cy = (kw-1)//2, i.e. the filter is centred on
+   each pixel (for even sizes, like the 'same' output of a full convolution).
+
+   Pixels outside the image are zero (mode 'zero') or mirrored about the
+   border (mode 'mirror').
+
+   The convolution is computed by whichever of these is cheapest (see
+   conv_costs), unless a method is given:
+      'separable' - two 1D passes, for rank-1 filters (Gaussian, Sobel, box)
+      'shifted'   - a sum of shifted copies of the image, for small filters
+      'fft'       - a product of spectra, for large filters
+
+   Arguments:
+      image    - a 2D numpy array
+      filt     - a 1D or 2D numpy array (or nested list) filter
+      mode     - 'zero' or 'mirror' boundary handling
+      method   - 'auto', 'separable', 'shifted' or 'fft'
+
+   Returns:
+      result   - a 2D numpy array, the same shape as image (float32 for
+                 float32 images, float64 otherwise)
+"""
+def conv_2d(image, filt, mode = 'zero', method = 'auto'):
+   image = np.asarray(image)
+   assert image.ndim == 2, 'image should be grayscale'
+   assert mode in ('zero', 'mirror'), 'mode should be zero or mirror'
+   filt = np.atleast_2d(np.asarray(filt, dtype=np.float64))
+   assert filt.ndim == 2, 'filter should be 1D or 2D'
+   dtype = filter_dtype(image)
+   image = image.astype(dtype, copy=False)
+
+   # 1. Extend the image so that every output pixel sees the full filter
+   kh, kw = filt.shape
+   cx, cy = (kh - 1) // 2, (kw - 1) // 2
+   extend = pad_border if mode == 'zero' else mirror_border
+   padded = extend(image, (kh - 1 - cx, cx), (kw - 1 - cy, cy))
+
+   # 2. Pick the cheapest method
+   factors = separate_filter(filt) if method in ('auto', 'separable') else None
+   if method == 'auto':
+      costs = conv_costs(image.shape, filt, factors)
+      method = min(costs, key=costs.get)
+   assert method in ('separable', 'shifted', 'fft'), 'unknown method ' + str(method)
+   assert method != 'separable' or factors is not None, 'filter is not separable'
+
+   # 3. Correlate the extended image with the flipped filter
+   flipped = filt[::-1, ::-1]
+   if method == 'separable':
+      col, row = factors
+      rows = correlate_shifted(padded, col[::-1, None], dtype)
+      return correlate_shifted(rows, row[None, ::-1], dtype)
+   if method == 'shifted':
+      return correlate_shifted(padded, flipped, dtype)
+   return correlate_fft(padded, flipped, dtype)
+
+# Gaussian kernels kept by gaussian_1d() for repeated sigmas
+GAUSSIAN_CACHE_SIZE = 32
+
+"""
+   Normalized 1D Gaussian of standard deviation sigma, sampled over
+   [-ceil(3 sigma), ceil(3 sigma)].
+
+   Kernels of the last GAUSSIAN_CACHE_SIZE sigmas are cached, so they are
+   returned read-only.
+"""
+@lru_cache(maxsize=GAUSSIAN_CACHE_SIZE)
+def gaussian_1d(sigma):
+   radius = int(np.ceil(3 * sigma))
+   x = np.arange(-radius, radius + 1)
+   g = np.exp(-(x**2) / (2 * sigma**2))
+   g /= np.sum(g)
+   g.flags.writeable = False
+   return g
+
+"""
+   Normalized 2D Gaussian of standard deviation sigma (the outer product of
+   gaussian_1d), cached and read-only like gaussian_1d().
+"""
+@lru_cache(maxsize=GAUSSIAN_CACHE_SIZE)
+def gaussian_2d(sigma):
+   g = gaussian_1d(sigma)
+   kernel = np.outer(g, g)
+   kernel.flags.writeable = False
+   return kernel
+
+# Smallest sigma of the recursive Gaussian, and the samples (in sigmas) by
+# which it extends a line past the image so that its tail settles
+RECURSIVE_MIN_SIGMA = 0.5
+RECURSIVE_MARGIN = 4
+
+"""
+   Coefficients of the recursive Gaussian of Young and van Vliet (1995): a
+   causal and an anticausal 3rd order filter
+      w[n] = B x[n] + a1 w[n-1] + a2 w[n-2] + a3 w[n-3]
+      y[n] = B w[n] + a1 y[n+1] + a2 y[n+2] + a3 y[n+3]
+   whose cascade approximates a Gaussian of standard deviation sigma.  Its
+   impulse response differs from the truncated kernel of gaussian_1d by up
+   to 9.4% of the peak along one axis, and from gaussian_2d by up to 14.6%
+   of the peak in 2D (measured for sigma 0.5 to 8; the worst at sigma 0.5
+   to 1.5, about 5% from sigma 3).
+
+   Returns:
+      B, a1, a2, a3
+"""
+@lru_cache(maxsize=GAUSSIAN_CACHE_SIZE)
+def recursive_coefficients(sigma):
+   assert sigma >= RECURSIVE_MIN_SIGMA, 'sigma should be at least ' + str(RECURSIVE_MIN_SIGMA)
+   if sigma >= 2.5:
+      q = 0.98711 * sigma - 0.96330
+   else:
+      q = 3.97156 - 4.14554 * np.sqrt(1 - 0.26891 * sigma)
+   b0 = 1.57825 + 2.44413 * q + 1.4281 * q**2 + 0.422205 * q**3
+   b1 = 2.44413 * q + 2.85619 * q**2 + 1.26661 * q**3
+   b2 = -(1.4281 * q**2 + 1.26661 * q**3)
+   b3 = 0.422205 * q**3
+   a1, a2, a3 = b1 / b0, b2 / b0, b3 / b0
+   return 1 - (a1 + a2 + a3), a1, a2, a3
+
+"""
+   Recursive Gaussian along the first axis of an image, one step per row
+   (a small matrix-vector product over the 3 previous rows).  The image is
+   extended past its border (zeros, or mirrored) by RECURSIVE_MARGIN sigmas;
+   the causal filter starts at rest (zero mode) or in the steady state of the
+   first row (mirror mode), and the anticausal filter in the steady state of
+   the last row.
+"""
+def recursive_axis(image, sigma, mode, dtype):
+   B, a1, a2, a3 = recursive_coefficients(sigma)
+   weights = np.array([a3, a2, a1], dtype=dtype)
+   margin = int(np.ceil(RECURSIVE_MARGIN * sigma))
+   before = 0 if mode == 'zero' else margin
+   extend = dict(mode='constant') if mode == 'zero' else dict(mode='symmetric')
+   lines = np.pad(image, ((before, margin), (0, 0)), **extend)
+   n = len(lines)
+
+   # 1. Causal pass, after 3 rows of initial state
+   w = np.empty((n + 3,) + lines.shape[1:], dtype=dtype)
+   w[:3] = 0 if mode == 'zero' else lines[0]
+   w[3:] = dtype(B) * lines
+   for i in range(3, n + 3):
+      w[i] += weights @ w[i-3:i]
+
+   # 2. Anticausal pass, in place, after 3 rows of initial state
+   y = np.empty_like(w)
+   y[n+3-3:] = w[n+2]
+   y[:n] = dtype(B) * w[3:]
+   y = y[::-1]
+   for i in range(3, n + 3):
+      y[i] += weights @ y[i-3:i]
+   return y[::-1][before:before+image.shape[0]]
+
+"""
+   Gaussian smoothing by the recursive filter along both axes.  The cost per
+   pixel does not depend on sigma, but conv_2d, which switches to the FFT for
+   large sigma, is about as fast or faster (see denoise_gaussian), and the
+   padded passes use about 1.5x its memory.
+"""
+def recursive_gaussian(image, sigma, mode = 'zero'):
+   dtype = filter_dtype(image)
+   image = image.astype(dtype, copy=False)
+   smoothed = recursive_axis(image, sigma, mode, dtype)
+   # Rows of the transposed (contiguous) image make the second pass vectorize well
+   smoothed = recursive_axis(np.ascontiguousarray(smoothed.T), sigma, mode, dtype)
+   return np.ascontiguousarray(smoothed.T)
+
+"""
+   GAUSSIAN DENOISING
+
+   Denoise an image by convolving it with a 2D Gaussian filter
+   G(x, y) = exp(-(x^2 + y^2) / (2 sigma^2)), normalized to sum to one and
+   truncated at 3 sigma.  conv_2d runs it as two 1D passes for small sigma
+   and by FFT for large sigma (whichever conv_costs estimates cheaper), so
+   its cost grows only slowly with sigma.
+
+   The 'recursive' method approximates the Gaussian by recursive (IIR)
+   filters instead (see recursive_gaussian), for sigma >= 0.5.  It is not a
+   speedup: on 512x512 to 2048x2048 images, for sigma 1-32, it ranges from
+   2x slower than the 'fir' method (sigma 1) to at most 20% faster (sigma
+   32 on 512x512), and it uses more memory.
+
+   Arguments:
+      image  - a 2D numpy array
+      sigma  - standard deviation of the Gaussian
+      mode   - boundary handling ('zero' or 'mirror')
+      method - 'fir' (truncated kernel) or 'recursive'
+
+   Returns:
+      img    - denoised image, a 2D numpy array of the same shape as the input
+"""
+def denoise_gaussian(image, sigma = 1.0, mode = 'zero', method = 'fir'):
+   assert method in ('fir', 'recursive'), 'method should be fir or recursive'
+   if method == 'recursive':
+      image = np.asarray(image)
+      assert image.ndim == 2, 'image should be grayscale'
+      assert mode in ('zero', 'mirror'), 'mode should be zero or mirror'
+      return recursive_gaussian(image, sigma, mode)
+   return conv_2d(image, gaussian_2d(sigma), mode)
+
+"""
+   Exact bilateral filter over a (2r+1) x (2r+1) window, r = ceil(3 sigma_s),
+   computed as one vectorized pass per window offset.  Pixels outside the
+   image do not contribute.
+"""
+def bilateral_exact(image, sigma_s, sigma_r):
+   dtype = filter_dtype(image)
+   image = image.astype(dtype, copy=False)
+   sx, sy = image.shape
+   radius = int(np.ceil(3 * sigma_s))
+   padded = pad_border(image, radius, radius)
+   valid = pad_border(np.ones((sx, sy), dtype=dtype), radius, radius)
+
+   total = np.zeros((sx, sy), dtype=dtype)
+   norm = np.zeros((sx, sy), dtype=dtype)
+   for dx in range(-radius, radius + 1):
+      for dy in range(-radius, radius + 1):
+         spatial = np.exp(-(dx**2 + dy**2) / (2 * sigma_s**2))
+         window = (slice(radius + dx, radius + dx + sx), slice(radius + dy, radius + dy + sy))
+         neighbour = padded[window]
+         weight = np.exp(-((neighbour - image)**2) / dtype(2 * sigma_r**2))
+         weight *= dtype(spatial) * valid[window]
+         total += weight * neighbour
+         norm += weight
+   return total / norm
+
+"""
+   Spread values over the 8 corners of the grid cells containing the given
+   fractional grid coordinates, with trilinear weights.
+
+   Arguments:
+      coords  - tuple of 3 numpy arrays of fractional coordinates
+      values  - tuple of numpy arrays of values to spread
+      shape   - shape of the grid
+
+   Returns:
+      a list of grids, one per values array
+"""
+def grid_splat(coords, values, shape):
+   base = [np.floor(c).astype(int) for c in coords]
+   frac = [c - b for c, b in zip(coords, base)]
+   grids = [np.zeros(int(np.prod(shape))) for _ in values]
+   for corner in range(8):
+      offset = [(corner >> axis) & 1 for axis in range(3)]
+      weight = np.ones(base[0].shape)
+      for f, o in zip(frac, offset):
+         weight = weight * (f if o else 1 - f)
+      index = np.ravel_multi_index([b + o for b, o in zip(base, offset)], shape)
+      for grid, value in zip(grids, values):
+         grid += np.bincount(index, weights=weight * value, minlength=grid.size)
+   return [grid.reshape(shape) for grid in grids]
+
+"""
+   Trilinear interpolation of a grid at fractional grid coordinates.
+"""
+def grid_slice(grid, coords):
+   base = [np.floor(c).astype(int) for c in coords]
+   frac = [c - b for c, b in zip(coords, base)]
+   result = np.zeros(base[0].shape)
+   for corner in range(8):
+      offset = [(corner >> axis) & 1 for axis in range(3)]
+      weight = np.ones(base[0].shape)
+      for f, o in zip(frac, offset):
+         weight = weight * (f if o else 1 - f)
+      result += weight * grid[tuple(b + o for b, o in zip(base, offset))]
+   return result
+
+# Longest axis blurred by a dense filter matrix in conv_axis()
+BLUR_MATRIX_SIZE = 512
+
+"""
+   Correlate an n-dimensional array with a symmetric 1D filter along one axis
+   (zero outside the array).  Short axes, such as those of a bilateral grid,
+   are multiplied by the banded n x n filter matrix, which runs as one BLAS
+   call; longer axes fall back to shifted slices.
+"""
+def conv_axis(array, filt, axis):
+   radius = len(filt) // 2
+   n = array.shape[axis]
+   if n <= BLUR_MATRIX_SIZE:
+      offset = np.arange(n)[None, :] - np.arange(n)[:, None]
+      matrix = np.where(np.abs(offset) <= radius, filt[np.clip(offset + radius, 0, len(filt) - 1)], 0)
+      out = np.tensordot(matrix.astype(array.dtype), array, axes=([1], [axis]))
+      return np.moveaxis(out, 0, axis)
+   moved = np.moveaxis(array, axis, 0)
+   out = filt[radius] * moved
+   for k in range(1, min(radius, n - 1) + 1):
+      out[:n-k] += filt[radius + k] * moved[k:]
+      out[k:] += filt[radius - k] * moved[:n-k]
+   return np.moveaxis(out, 0, axis)
+
+"""
+   Cell sizes and blur filters of a bilateral grid.
+
+   Arguments:
+      sigma_s  - spatial gaussian std
+      sigma_r  - range gaussian std
+      accuracy - grid cells per sigma along each axis
+
+   Returns:
+      cell_s   - cell size in pixels (at least one)
+      cell_r   - cell size in intensity levels
+      filt_s   - 1D Gaussian blurring the spatial axes of the grid
+      filt_r   - 1D Gaussian blurring the intensity axis of the grid
+      margin   - empty cells padding each side of the grid
+"""
+def grid_spacing(sigma_s, sigma_r, accuracy):
+   cell_s = max(sigma_s / accuracy, 1.0)
+   cell_r = sigma_r / accuracy
+   filt_s = gaussian_1d(sigma_s / cell_s)
+   filt_r = gaussian_1d(accuracy)
+   margin = max(len(filt_s), len(filt_r)) // 2 + 1
+   return cell_s, cell_r, filt_s, filt_r, margin
+
+# Cost of the bilateral grid per pixel (splatting and slicing), per grid cell
+# (blurring by filter matrices) and per grid cell and filter tap of each axis
+# longer than BLUR_MATRIX_SIZE (blurring by shifted slices), in units of one
+# tap over one pixel of bilateral_exact (measured on 256x256 to 1024x1024
+# images)
+GRID_PIXEL_COST = 50
+GRID_CELL_COST = 8
+GRID_TAP_COST = 0.65
+
+"""
+   Estimate the cost of the exact and grid bilateral filters of an image.
+
+   Arguments:
+      image    - a 2D numpy array
+      sigma_s  - spatial gaussian std
+      sigma_r  - range gaussian std
+      accuracy - grid cells per sigma along each axis
+
+   Returns:
+      a dict mapping 'exact' and 'grid' to an estimated number of taps
+"""
+def bilateral_costs(image, sigma_s, sigma_r, accuracy):
+   sx, sy = image.shape
+   cell_s, cell_r, filt_s, filt_r, margin = grid_spacing(sigma_s, sigma_r, accuracy)
+   span = float(image.max()) - float(image.min()) if image.size else 0.0
+   cells, cell_cost = 1, GRID_CELL_COST
+   for extent, cell, filt in ((sx - 1, cell_s, filt_s), (sy - 1, cell_s, filt_s), (span, cell_r, filt_r)):
+      n = int(np.ceil(extent / cell)) + 2 * margin + 1
+      cells *= n
+      if n > BLUR_MATRIX_SIZE:
+         cell_cost += GRID_TAP_COST * len(filt)
+   return {
+      'exact': (2 * int(np.ceil(3 * sigma_s)) + 1)**2 * sx * sy,
+      'grid': GRID_PIXEL_COST * sx * sy + cell_cost * cells,
+   }
+
+"""
+   Bilateral filter approximated on a bilateral grid (Paris and Durand 2006,
+   Chen et al. 2007): pixel values and weights are splatted into a coarse
+   (x, y, intensity) grid whose cells are sigma_s / accuracy pixels (but at
+   least one pixel) and sigma_r / accuracy intensity levels wide, the grid is
+   blurred with a 3D Gaussian, and the result is read back by trilinear
+   interpolation.
+
+   The cost is O(pixels) for splatting and slicing plus O(grid cells) for
+   the blur, and the number of cells falls as sigma_s grows.
+"""
+def bilateral_grid(image, sigma_s, sigma_r, accuracy):
+   dtype = filter_dtype(image)
+   image = np.asarray(image, dtype=np.float64)
+   sx, sy = image.shape
+   cell_s, cell_r, filt_s, filt_r, margin = grid_spacing(sigma_s, sigma_r, accuracy)
+
+   # 1. Grid coordinates of every pixel, with a margin for the blur
+   low = image.min()
+   x = np.arange(sx)[:, None] / cell_s + margin
+   y = np.arange(sy)[None, :] / cell_s + margin
+   coords = (np.broadcast_to(x, image.shape).ravel(), np.broadcast_to(y, image.shape).ravel(),
+             ((image - low) / cell_r + margin).ravel())
+   shape = tuple(int(np.ceil(c.max())) + margin + 1 for c in coords)
+
+   # 2. Splat intensities and counts (homogeneous coordinates)
+   total, norm = grid_splat(coords, (image.ravel(), np.ones(image.size)), shape)
+
+   # 3. Blur along x, y and intensity (in single precision, which is ample for
+   #    weights that are sliced back by interpolation)
+   total = total.astype(np.float32)
+   norm = norm.astype(np.float32)
+   for axis, filt in enumerate((filt_s, filt_s, filt_r)):
+      total = conv_axis(total, filt, axis)
+      norm = conv_axis(norm, filt, axis)
+
+   # 4. Slice and normalize
+   result = grid_slice(total, coords) / grid_slice(norm, coords)
+   return result.reshape(image.shape).astype(dtype, copy=False)
+
+"""
+   BILATERAL DENOISING
+
+   Denoise an image by bilateral filtering:
+   BF[I]_p = 1/W_p sum_{q in S} G_s(||p-q||) G_r(|I_p-I_q|) I_q
+
+   The exact filter costs O(pixels x sigma_s^2).  The 'grid' method
+   approximates it on a bilateral grid at a cost that barely depends on
+   sigma_s; accuracy sets how finely the grid samples each sigma (higher is
+   more accurate and slower, 1-2 is typical).  For small sigma_s / accuracy
+   the grid has several cells per pixel and is slower than the exact filter,
+   so 'grid' runs the exact filter whenever bilateral_costs estimates it to
+   be cheaper (roughly when sigma_s / accuracy is below 2 pixels).
+
+   Arguments:
+      image    - a 2D numpy array
+      sigma_s  - spatial gaussian std
+      sigma_r  - range gaussian std
+      method   - 'exact' or 'grid'
+      accuracy - grid cells per sigma along each axis ('grid' only)
+
+   Returns:
+      img      - denoised image, a 2D numpy array of the same shape as the input
+"""
+def denoise_bilateral(image, sigma_s = 1, sigma_r = 25.5, method = 'exact', accuracy = 1.0):
+   image = np.asarray(image)
+   assert image.ndim == 2, 'image should be grayscale'
+   assert method in ('exact', 'grid'), 'method should be exact or grid'
+   if method == 'grid':
+      costs = bilateral_costs(image, sigma_s, sigma_r, accuracy)
+      if costs['grid'] < costs['exact']:
+         return bilateral_grid(image, sigma_s, sigma_r, accuracy)
+   return bilateral_exact(image, sigma_s, sigma_r)
+
+"""
+   SMOOTHING AND DOWNSAMPLING
+
+   Smooth an image with a Gaussian of standard deviation downsample_factor/2
+   to remove the frequencies that would alias, then keep every
+   downsample_factor-th row and column.
+
+   Arguments:
+      image             - a 2D numpy array
+      downsample_factor - an integer specifying downsample rate
+      method            - Gaussian of denoise_gaussian ('fir' or 'recursive')
+
+   Returns:
+      result            - downsampled image, a 2D numpy array with spatial
+                          dimension reduced
+"""
+def smooth_and_downsample(image, downsample_factor = 2, method = 'fir'):
+   smoothed = denoise_gaussian(image, downsample_factor / 2.0, method=method)
+   return smoothed[::downsample_factor, ::downsample_factor]
+
+# Sobel operators (convolution kernels) of the horizontal and vertical gradient
+SOBEL_DX = np.array([[1, 0, -1], [2, 0, -2], [1, 0, -1]])
+SOBEL_DY = np.array([[1, 2, 1], [0, 0, 0], [-1, -2, -1]])
+
+"""
+   SOBEL GRADIENT OPERATOR
+
+   Compute an estimate of the horizontal and vertical gradients of an image
+   by convolving with the Sobel operators.
+
+   Arguments:
+      image - a 2D numpy array
+      mode  - boundary handling of conv_2d ('zero' or 'mirror')
+
+   Returns:
+      dx    - gradient in x-direction at each point (a 2D numpy array,
+              the same shape as the input image)
+      dy    - gradient in y-direction at each point (a 2D numpy array,
+              the same shape as the input image)
+"""
+def sobel_gradients(image, mode = 'zero'):
+   dx = conv_2d(image, SOBEL_DX, mode)
+   dy = conv_2d(image, SOBEL_DY, mode)
+   return dx, dy
+
+# (row, column) offsets of the neighbours along the gradient direction,
+# for gradient directions quantized to 0, 45, 90 and 135 degrees
+NONMAX_OFFSETS = ((0, 1), (1, 1), (1, 0), (1, -1))
+
+"""
+   NONMAXIMUM SUPPRESSION
+
+   Thin an edge strength map by keeping only the pixels whose magnitude is a
+   local maximum along the gradient direction, i.e. perpendicular to the
+   edge.  The direction is quantized to the nearest of the 4 neighbour
+   axes, and a pixel is kept if its magnitude is at least that of both of
+   its neighbours along that axis (pixels outside the image count as zero).
+
+   Arguments:
+      mag     - a 2D numpy array of edge strength (or an (N, H, W) stack)
+      theta   - a numpy array of gradient directions, in radians
+                (arctan2(dy, dx)), the same shape as mag
+
+   Returns:
+      nonmax  - the thinned edge strength map, a numpy array of the same
+                shape as mag with suppressed pixels set to zero
+"""
+def nonmax_suppress(mag, theta):
+   sx, sy = mag.shape[-2:]
+   direction = np.round(np.mod(theta, np.pi) / (np.pi / 4)).astype(int) % 4
+   padded = np.pad(mag, [(0, 0)] * (mag.ndim - 2) + [(1, 1), (1, 1)])
+   nonmax = mag.copy()
+   for d, (ox, oy) in enumerate(NONMAX_OFFSETS):
+      before = padded[..., 1-ox:1-ox+sx, 1-oy:1-oy+sy]
+      after = padded[..., 1+ox:1+ox+sx, 1+oy:1+oy+sy]
+      nonmax[(direction == d) & ((mag < before) | (mag < after))] = 0
+   return nonmax
+
+"""
+   Runs of consecutive set pixels along the rows of a binary image.
+
+   Returns:
+      rows   - row of every run
+      starts - first column of every run
+      ends   - column after the last pixel of every run
+"""
+def mask_runs(mask):
+   sx, sy = mask.shape
+   padded = np.zeros((sx, sy + 2), dtype=np.int8)
+   padded[:, 1:-1] = mask
+   change = np.diff(padded, axis=1)
+   rows, starts = np.nonzero(change == 1)
+   _, ends = np.nonzero(change == -1)
+   return rows, starts, ends
+
+"""
+   Pairs of 8-connected runs in consecutive rows.
+
+   Runs are sorted by row and then by column, so the runs of row r that
+   touch a run [s, e) of row r + 1 are the contiguous range of those with
+   end >= s and start <= e; both bounds are found by binary search.
+
+   Returns:
+      a, b   - indices of connected runs (a in the upper row)
+"""
+def run_links(rows, starts, ends, width):
+   stride = width + 2
+   start_keys = rows * stride + starts
+   end_keys = rows * stride + ends
+   upper = rows - 1
+   lo = np.searchsorted(end_keys, upper * stride + starts, side='left')
+   hi = np.searchsorted(start_keys, upper * stride + ends, side='right')
+   counts = np.maximum(hi - lo, 0)
+   b = np.repeat(np.arange(len(rows)), counts)
+   a = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+   return a, b
+
+"""
+   Connected components of a graph, by vectorized union-find: every round
+   hooks the root of each edge's larger endpoint onto the smaller root, then
+   compresses all paths by pointer jumping.  Each round is linear in the
+   nodes and edges, and long chains are merged in one round (pointer jumping
+   halves their depth at each step), so the number of rounds does not grow
+   with their length.
+
+   Arguments:
+      n      - number of nodes
+      a, b   - numpy arrays of edge endpoints
+
+   Returns:
+      roots  - smallest node of the component of every node
+"""
+def union_find(n, a, b):
+   parent = np.arange(n)
+   while True:
+      ra, rb = parent[a], parent[b]
+      differ = ra != rb
+      if not differ.any():
+         return parent
+      np.minimum.at(parent, np.maximum(ra, rb)[differ], np.minimum(ra, rb)[differ])
+      while True:
+         grand = parent[parent]
+         if np.array_equal(grand, parent):
+            break
+         parent = grand
+
+"""
+   Label the 8-connected components of a binary image.
+
+   The set pixels are grouped into row runs, runs touching in consecutive
+   rows are linked, and the runs are merged with union_find(), so the cost
+   is linear in the number of runs.
+
+   A stack of masks (N, H, W) is labeled as one tall image with an empty
+   row between the masks, so labels are unique over the whole stack.
+
+   Arguments:
+      mask   - a 2D boolean numpy array (or an (N, H, W) stack)
+
+   Returns:
+      labels - a numpy array of component labels 1..count, the shape of mask
+               (0 where mask is not set)
+      count  - number of components
+"""
+def label_components(mask):
+   if mask.ndim == 3:
+      n, sx, sy = mask.shape
+      tall = np.pad(mask, ((0, 0), (0, 1), (0, 0))).reshape(n * (sx + 1), sy)
+      labels, count = label_components(tall)
+      return labels.reshape(n, sx + 1, sy)[:, :sx], count
+   rows, starts, ends = mask_runs(mask)
+   a, b = run_links(rows, starts, ends, mask.shape[1])
+   roots = union_find(len(rows), a, b)
+   _, run_labels = np.unique(roots, return_inverse=True)
+
+   # Paint the label of every run over its pixels
+   lengths = ends - starts
+   offsets = np.repeat(rows * mask.shape[1] + starts - np.cumsum(lengths) + lengths, lengths)
+   labels = np.zeros(mask.size, dtype=np.int64)
+   labels[offsets + np.arange(lengths.sum())] = np.repeat(run_labels + 1, lengths)
+   return labels.reshape(mask.shape), int(run_labels.max(initial=-1)) + 1
+
+# Hysteresis thresholds: the high threshold is this percentile of the
+# nonzero edge strengths, and the low threshold this fraction of it
+EDGE_HIGH_PERCENTILE = 90
+EDGE_LOW_RATIO = 0.4
+
+"""
+   Default hysteresis thresholds of an edge strength map.
+
+   Returns:
+      low, high - the low and high thresholds
+"""
+def hysteresis_thresholds(nonmax):
+   strengths = nonmax[nonmax > 0]
+   if strengths.size == 0:
+      return 0.0, 0.0
+   high = float(np.percentile(strengths, EDGE_HIGH_PERCENTILE))
+   return EDGE_LOW_RATIO * high, high
+
+"""
+   EDGE LINKING AND HYSTERESIS THRESHOLDING
+
+   Pixels of the thinned edge strength map above the high threshold are
+   strong edges; those above the low threshold are weak edges, and are kept
+   when they connect (8-connected, through other weak edges) to a strong
+   edge.
+
+   All connected components of weak and strong pixels are labeled at once
+   (see label_components) and the components containing a strong pixel are
+   kept, so the cost is linear in the number of edge pixels whatever the
+   length of the edge chains.
+
+   Arguments:
+      nonmax - a 2D numpy array, output of nonmax_suppress() (or an (N, H, W)
+               stack, linked image by image)
+      low    - (optional) low threshold
+      high   - (optional) high threshold; thresholds that are not given come
+               from hysteresis_thresholds(), per image for a stack
+
+   Returns:
+      edge   - a boolean numpy array, the same shape as nonmax, marking the
+               edge pixels
+"""
+def hysteresis_edge_linking(nonmax, low = None, high = None):
+   if low is None or high is None:
+      if nonmax.ndim == 3:
+         default_low, default_high = np.reshape([hysteresis_thresholds(image) for image in nonmax], (-1, 2)).T[:, :, None, None]
+      else:
+         default_low, default_high = hysteresis_thresholds(nonmax)
+      low = default_low if low is None else low
+      high = default_high if high is None else high
+
+   labels, count = label_components(nonmax > low)
+   keep = np.zeros(count + 1, dtype=bool)
+   keep[labels[nonmax > high]] = True
+   keep[0] = False
+   return keep[labels]
+
+"""
+   Steps 1-3 of canny(): edge strength and edge strength after nonmaximum
+   suppression.  The Gaussian and Sobel filters always run as separable
+   passes, which compute every pixel by the same operations whatever the
+   size of the image, so an image, its tiles (canny_tiled) and a stack of
+   images (canny_stack) give bit-identical results; rounding differences of
+   other methods would flip ties of nonmaximum suppression.
+"""
+def canny_nonmax(image, sigma):
+   smoothed = conv_2d(image, gaussian_2d(sigma), 'mirror', 'separable')
+   dx = conv_2d(smoothed, SOBEL_DX, 'mirror', 'separable')
+   dy = conv_2d(smoothed, SOBEL_DY, 'mirror', 'separable')
+   mag = np.sqrt(dx**2 + dy**2)
+   return mag, nonmax_suppress(mag, np.arctan2(dy, dx))
+
+"""
+   CANNY EDGE DETECTION
+
+   1) Smooth the image with a Gaussian and compute gradients in the x- and
+      y-directions with the Sobel operators (mirroring the border, so that
+      it does not show up as an edge).
+   2) Estimate edge strength (gradient magnitude) and direction.
+   3) Thin the edge strength map by nonmaximum suppression.
+   4) Link weak edges to strong edges by hysteresis thresholding.
+
+   Arguments:
+      image  - a 2D numpy array
+      sigma  - standard deviation of the smoothing Gaussian
+      low    - (optional) low hysteresis threshold
+      high   - (optional) high hysteresis threshold
+
+   Returns:
+      mag    - edge strength (gradient magnitude), a 2D numpy array
+      nonmax - edge strength after nonmaximum suppression
+      edge   - a 2D boolean numpy array marking the edge pixels
+"""
+def canny(image, sigma = 1.0, low = None, high = None):
+   mag, nonmax = canny_nonmax(image, sigma)
+   edge = hysteresis_edge_linking(nonmax, low, high)
+   return mag, nonmax, edge
+
+"""
+   Convolve every image of an (N, H, W) stack with the same filter, as
+   conv_2d() does for one image: by two 1D passes for rank-1 filters, by
+   shifted copies otherwise.
+"""
+def conv_stack(stack, filt, mode = 'zero'):
+   assert mode in ('zero', 'mirror'), 'mode should be zero or mirror'
+   filt = np.atleast_2d(np.asarray(filt, dtype=np.float64))
+   dtype = filter_dtype(stack)
+   kh, kw = filt.shape
+   cx, cy = (kh - 1) // 2, (kw - 1) // 2
+   pad = ((0, 0), (kh - 1 - cx, cx), (kw - 1 - cy, cy))
+   padded = np.pad(stack.astype(dtype, copy=False), pad, mode='constant' if mode == 'zero' else 'symmetric')
+   factors = separate_filter(filt)
+   if factors is None:
+      return correlate_shifted(padded, filt[::-1, ::-1], dtype)
+   col, row = factors
+   rows = correlate_shifted(padded, col[::-1, None], dtype)
+   return correlate_shifted(rows, row[None, ::-1], dtype)
+
+"""
+   Canny edge detection of an (N, H, W) stack with array operations over the
+   whole stack; same steps and results as canny() on every image.
+"""
+def canny_batch(stack, sigma = 1.0, low = None, high = None):
+   smoothed = conv_stack(stack, gaussian_2d(sigma), 'mirror')
+   dx = conv_stack(smoothed, SOBEL_DX, 'mirror')
+   dy = conv_stack(smoothed, SOBEL_DY, 'mirror')
+   mag = np.sqrt(dx**2 + dy**2)
+   theta = np.arctan2(dy, dx)
+   nonmax = nonmax_suppress(mag, theta)
+   edge = hysteresis_edge_linking(nonmax, low, high)
+   return mag, nonmax, edge
+
+"""
+   BATCHED CANNY EDGE DETECTION
+
+   Run canny() over many images, sharing the filters and paying the per-call
+   overhead once per batch instead of once per image.
+
+   An (N, H, W) array is processed in batches of batch_size images with
+   array operations over each batch (see canny_batch).  Images from another
+   iterable are read batch_size at a time; within a batch, images of the
+   same shape are stacked and processed together, and the images whose shape
+   is unique are fanned out over a pool of worker processes.
+
+   Arguments:
+      images     - an (N, H, W) numpy array, or an iterable of 2D numpy arrays
+      sigma      - standard deviation of the smoothing Gaussian
+      low        - (optional) low hysteresis threshold
+      high       - (optional) high hysteresis threshold (thresholds that are
+                   not given are chosen per image)
+      batch_size - images processed together
+      processes  - (optional) number of worker processes (default: all CPUs)
+
+   Returns:
+      mag, nonmax, edge - (N, H, W) arrays when all images have the same
+                          shape, otherwise lists of 2D arrays, in the order of
+                          the images (see canny())
+"""
+def canny_stack(images, sigma = 1.0, low = None, high = None, batch_size = 64, processes = None):
+   if isinstance(images, np.ndarray):
+      assert images.ndim == 3, 'images should be an (N, H, W) stack'
+      batches = [canny_batch(images[i:i+batch_size], sigma, low, high) for i in range(0, len(images), batch_size)]
+      if not batches:
+         return canny_batch(images, sigma, low, high)
+      return tuple(np.concatenate(parts) for parts in zip(*batches))
+
+   results = []
+   pool = None
+   try:
+      images = iter(images)
+      while True:
+         batch = [np.asarray(image) for _, image in zip(range(batch_size), images)]
+         if not batch:
+            break
+         batch_results = [None] * len(batch)
+
+         # 1. Stack the images of the batch that share a shape
+         groups = {}
+         for i, image in enumerate(batch):
+            groups.setdefault(image.shape, []).append(i)
+         singles = []
+         for indices in groups.values():
+            if len(indices) == 1:
+               singles.extend(indices)
+               continue
+            stacked = canny_batch(np.stack([batch[i] for i in indices]), sigma, low, high)
+            for k, i in enumerate(indices):
+               batch_results[i] = tuple(part[k] for part in stacked)
+
+         # 2. Fan the remaining images out over the workers
+         detect = partial(canny, sigma=sigma, low=low, high=high)
+         if len(singles) > 1:
+            if pool is None:
+               pool = Pool(processes)
+            outputs = pool.map(detect, [batch[i] for i in singles])
+         else:
+            outputs = [detect(batch[i]) for i in singles]
+         for i, output in zip(singles, outputs):
+            batch_results[i] = output
+         results.extend(batch_results)
+   finally:
+      if pool is not None:
+         pool.close()
+         pool.join()
+
+   mags, nonmaxes, edges = (list(parts) for parts in zip(*results)) if results else ([], [], [])
+   if mags and all(mag.shape == mags[0].shape for mag in mags):
+      return np.stack(mags), np.stack(nonmaxes), np.stack(edges)
+   return mags, nonmaxes, edges
+
+"""
+   Tiles of an image, in row-major order.
+
+   Returns:
+      a list of (y0, y1, x0, x1) regions of at most tile_size x tile_size
+"""
+def tile_regions(shape, tile_size):
+   sx, sy = shape
+   return [(y0, min(y0 + tile_size, sx), x0, min(x0 + tile_size, sy))
+           for y0 in range(0, sx, tile_size) for x0 in range(0, sy, tile_size)]
+
+"""
+   Edge strength after nonmaximum suppression of one tile of an image, as
+   canny() computes it on the whole image.  The tile is read with a halo of
+   ceil(3 sigma) + 2 pixels (clipped to the image), covering the support of
+   the Gaussian, the Sobel operators and nonmaximum suppression, so that the
+   result is exact on the tile.
+"""
+def tile_nonmax(image, region, sigma):
+   y0, y1, x0, x1 = region
+   halo = int(np.ceil(3 * sigma)) + 2
+   hy0, hx0 = max(y0 - halo, 0), max(x0 - halo, 0)
+   tile = np.asarray(image[hy0:min(y1 + halo, image.shape[0]), hx0:min(x1 + halo, image.shape[1])])
+   _, nonmax = canny_nonmax(tile, sigma)
+   return nonmax[y0-hy0:y1-hy0, x0-hx0:x1-hx0]
+
+# Histogram bins used to find percentiles of out-of-core edge strengths
+PERCENTILE_BINS = 4096
+
+"""
+   Exact percentile of the nonzero values of a (memory-mapped) array, read
+   one region at a time: a histogram of the values locates the two ranks
+   that np.percentile interpolates between, and a second pass collects only
+   the values of their bins.
+"""
+def tiled_percentile(array, regions, q):
+   def bins(values, largest):
+      return np.minimum((values / largest * PERCENTILE_BINS).astype(int), PERCENTILE_BINS - 1)
+
+   tiles = lambda: (array[y0:y1, x0:x1] for y0, y1, x0, x1 in regions)
+   largest = max((float(tile.max(initial=0)) for tile in tiles()), default=0.0)
+   if largest <= 0:
+      return 0.0
+
+   # 1. Histogram of the nonzero values
+   counts = np.zeros(PERCENTILE_BINS, dtype=np.int64)
+   for tile in tiles():
+      values = tile[tile > 0]
+      counts += np.bincount(bins(values, largest), minlength=PERCENTILE_BINS)
+
+   # 2. Bins holding the ranks on either side of the percentile
+   position = q / 100 * (counts.sum() - 1)
+   ranks = [int(np.floor(position)), int(np.ceil(position))]
+   ends = np.cumsum(counts)
+   first, last = np.searchsorted(ends, ranks, side='right')
+
+   # 3. Sorted values of those bins
+   selected = []
+   for tile in tiles():
+      values = tile[tile > 0]
+      index = bins(values, largest)
+      selected.append(values[(index >= first) & (index <= last)])
+   selected = np.sort(np.concatenate(selected))
+   below = ends[first - 1] if first > 0 else 0
+   low, high = selected[ranks[0] - below], selected[ranks[1] - below]
+   return float(low + (position - ranks[0]) * (high - low))
+
+"""
+   Links between the labels of two adjacent lines of pixels (8-connected).
+
+   Returns:
+      a, b - labels of connected pixels (0 is background and never linked)
+"""
+def seam_links(first, second):
+   a, b = [], []
+   for shift in (-1, 0, 1):
+      upper = first[max(shift, 0):len(first) + min(shift, 0)]
+      lower = second[max(-shift, 0):len(second) + min(-shift, 0)]
+      both = (upper > 0) & (lower > 0)
+      a.append(upper[both])
+      b.append(lower[both])
+   return np.concatenate(a), np.concatenate(b)
+
+"""
+   TILED CANNY EDGE DETECTION
+
+   Canny edge detection of an image too large for memory, e.g. a
+   memory-mapped .npy file, with the same result as canny().  The image is
+   streamed through tiles of tile_size x tile_size pixels in four passes, so
+   that only a few tiles of intermediate arrays are held in memory at once:
+
+   1) Nonmaximum suppression of every tile, read with a halo covering the
+      Gaussian, Sobel and suppression support (see tile_nonmax), into a
+      memory-mapped array.
+   2) Hysteresis thresholds over the whole image, if they are not given
+      (see tiled_percentile).
+   3) Connected components of weak and strong pixels labeled tile by tile
+      (see label_components), with labels numbered across tiles, into a
+      memory-mapped array; components that meet across the seams between
+      tiles are then merged by union_find() over the labels of the pixel
+      rows and columns on either side of every seam.
+   4) Components containing a strong pixel are written to the edge map.
+
+   Intermediate arrays are memory-mapped in workdir (a temporary directory by
+   default) and removed afterwards.
+
+   Arguments:
+      image     - a 2D numpy array or memmap, or the file name of a 2D .npy
+                  array (opened memory-mapped)
+      output    - (optional) file name of the .npy edge map to write
+                  (memory-mapped); by default the edge map is kept in memory
+      sigma     - standard deviation of the smoothing Gaussian
+      low       - (optional) low hysteresis threshold
+      high      - (optional) high hysteresis threshold
+      tile_size - side of the tiles, in pixels
+      workdir   - (optional) directory of the intermediate arrays
+
+   Returns:
+      edge      - a 2D boolean numpy array (a memmap if output is given)
+                  marking the edge pixels
+"""
+def canny_tiled(image, output = None, sigma = 1.0, low = None, high = None, tile_size = 512, workdir = None):
+   if isinstance(image, str):
+      image = np.load(image, mmap_mode='r')
+   assert image.ndim == 2, 'image should be grayscale'
+   shape = image.shape
+   regions = tile_regions(shape, tile_size)
+   dtype = filter_dtype(image)
+
+   with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+      # 1. Nonmaximum suppression, tile by tile
+      nonmax = np.lib.format.open_memmap(os.path.join(tmp, 'nonmax.npy'), 'w+', dtype, shape)
+      for y0, y1, x0, x1 in regions:
+         nonmax[y0:y1, x0:x1] = tile_nonmax(image, (y0, y1, x0, x1), sigma)
+
+      # 2. Thresholds of the whole image
+      if low is None or high is None:
+         default_high = tiled_percentile(nonmax, regions, EDGE_HIGH_PERCENTILE)
+         low = EDGE_LOW_RATIO * default_high if low is None else low
+         high = default_high if high is None else high
+
+      # 3. Label components tile by tile, numbering labels across tiles
+      labels = np.lib.format.open_memmap(os.path.join(tmp, 'labels.npy'), 'w+', np.int64, shape)
+      strong = [np.zeros(1, dtype=bool)]
+      count = 0
+      for y0, y1, x0, x1 in regions:
+         tile = np.asarray(nonmax[y0:y1, x0:x1])
+         tile_labels, tile_count = label_components(tile > low)
+         tile_strong = np.zeros(tile_count + 1, dtype=bool)
+         tile_strong[tile_labels[tile > high]] = True
+         strong.append(tile_strong[1:])
+         labels[y0:y1, x0:x1] = np.where(tile_labels > 0, tile_labels + count, 0)
+         count += tile_count
+      strong = np.concatenate(strong)
+
+      # Merge the components that meet across the seams
+      links = [seam_links(labels[y - 1], labels[y]) for y in range(tile_size, shape[0], tile_size)]
+      links += [seam_links(labels[:, x - 1], labels[:, x]) for x in range(tile_size, shape[1], tile_size)]
+      a, b = (np.concatenate(parts) for parts in zip(*links)) if links else (np.zeros(0, dtype=int),) * 2
+      roots = union_find(count + 1, a, b)
+      root_strong = np.zeros(count + 1, dtype=bool)
+      root_strong[roots[strong]] = True
+      keep = root_strong[roots]
+      keep[0] = False
+
+      # 4. Edge map of the components with a strong pixel
+      if output is None:
+         edge = np.zeros(shape, dtype=bool)
+      else:
+         edge = np.lib.format.open_memmap(output, 'w+', bool, shape)
+      for y0, y1, x0, x1 in regions:
+         edge[y0:y1, x0:x1] = keep[labels[y0:y1, x0:x1]]
+      if output is not None:
+         edge.flush()
+      del nonmax, labels
+   return edge
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+"""
+   FEATURE CACHE
+
+   Content-addressed cache of interest points and feature descriptors.
+
+   Entries are keyed by a hash of the image pixels, shape and dtype together
+   with the detection parameters, so the same image is only processed once
+   no matter how it reaches the detector.  Entries live in an in-memory LRU
+   bounded by max_bytes; if a directory is given they are also written there
+   as one .npy file per array and read back memory-mapped, so a template
+   library computed once loads in milliseconds in later processes.  Only
+   arrays held in memory count towards max_bytes: memory-mapped entries read
+   from the store cost pages of the file, not of the process.
+
+   Arguments:
+      max_bytes - memory budget of the in-memory entries
+      directory - (optional) directory of the on-disk store
+"""
+class FeatureCache:
+   names = ('xs', 'ys', 'scores', 'feats')
+
+   def __init__(self, max_bytes = 256 << 20, directory = None):
+      self.max_bytes = max_bytes
+      self.directory = directory
+      self.entries = OrderedDict()
+      self.nbytes = 0
+      self.hits = 0
+      self.misses = 0
+      if directory is not None:
+         os.makedirs(directory, exist_ok=True)
+
+   # Cache key of an image and the parameters its features depend on
+   def key(self, image, *params):
+      image = np.ascontiguousarray(image)
+      digest = hashlib.sha1(image.data)
+      digest.update(repr((image.shape, image.dtype.str, params)).encode())
+      return digest.hexdigest()
+
+   # Look up an entry, first in memory and then on disk.
+   # Returns the tuple (xs, ys, scores, feats), or None if the key is unknown
+   def get(self, key):
+      arrays = self.entries.get(key)
+      if arrays is not None:
+         self.entries.move_to_end(key)
+         self.hits += 1
+         return arrays
+
+      path = self.path(key)
+      if path is not None and os.path.isdir(path):
+         arrays = tuple(np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in self.names)
+         self.remember(key, arrays)
+         self.hits += 1
+         return arrays
+
+      self.misses += 1
+      return None
+
+   # Store the tuple (xs, ys, scores, feats) in memory and, if enabled, on disk
+   def put(self, key, arrays):
+      arrays = tuple(np.asarray(array) for array in arrays)
+      path = self.path(key)
+      if path is not None and not os.path.isdir(path):
+         # Write to a temporary directory first so readers never see partial entries
+         staging = tempfile.mkdtemp(dir=self.directory)
+         for name, array in zip(self.names, arrays):
+            np.save(os.path.join(staging, name + '.npy'), array)
+         try:
+            os.rename(staging, path)
+         except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+      self.remember(key, arrays)
+
+   # Bytes of an entry held in memory (memory-mapped arrays count as zero)
+   @staticmethod
+   def resident_bytes(arrays):
+      return sum(array.nbytes for array in arrays if not isinstance(array, np.memmap))
+
+   # Add an entry to the in-memory LRU
+   def remember(self, key, arrays):
+      size = self.resident_bytes(arrays)
+      if key in self.entries:
+         self.nbytes -= self.resident_bytes(self.entries.pop(key))
+      if size > self.max_bytes:
+         return
+      self.entries[key] = arrays
+      self.nbytes += size
+      # Evict least recently used in-memory entries until within budget
+      # (evicting memory-mapped entries would free nothing)
+      for old in list(self.entries):
+         if self.nbytes <= self.max_bytes:
+            break
+         size = self.resident_bytes(self.entries[old])
+         if size:
+            del self.entries[old]
+            self.nbytes -= size
+
+   def path(self, key):
+      if self.directory is None:
+         return None
+      return os.path.join(self.directory, key)
+
+   def clear(self):
+      self.entries.clear()
+      self.nbytes = 0
@@ -1,7 +1,175 @@
 import numpy as np
 from edge_detection import *
+from ann_index import query_ann_index
+from profiling import profile_stage
 from cmath import pi
 
+"""
+   Compute the bounds of the windows a[i-radius : i+radius+1] for every i.
+
+   The bounds follow Python slicing rules exactly, so a window whose start
+   falls before 0 wraps to the end of the axis (and is empty for any axis
+   longer than the window) while a window running past the end is truncated.
+
+   Arguments:
+      n        - length of the axis
+      radius   - half-width of the window
+
+   Returns:
+      lo, hi   - numpy arrays of shape (n,) with the start and stop index of
+                 each window (hi <= lo denotes an empty window)
+"""
+def window_bounds(n, radius):
+   index = np.arange(n)
+   lo = index - radius
+   lo = np.clip(np.where(lo < 0, lo + n, lo), 0, n)
+   hi = np.minimum(index + radius + 1, n)
+   return lo, np.maximum(hi, lo)
+
+"""
+   Floating point type the pipeline works in for an array: float32 arrays are
+   processed in float32 end to end, anything else in float64.
+"""
+def working_dtype(a):
+   return np.float32 if np.asarray(a).dtype == np.float32 else np.float64
+
+# Largest radius for which window sums are taken as shifted sums rather than
+# as differences of running sums
+SHIFTED_SUM_RADIUS = 8
+
+"""
+   Sum a 2D array over a (2*radius+1) x (2*radius+1) window centred on every
+   pixel, in a single pass over the whole array.
+
+   The sums are computed separably along each axis: for small windows as sums
+   of shifted copies, which keeps float32 sums as accurate as the data, and
+   for large windows as differences of float64 running sums, whose cost is
+   independent of the window size.  Border windows match slicing
+   a[y-radius : y+radius+1, x-radius : x+radius+1] (see window_bounds).
+
+   Arguments:
+      a        - a 2D numpy array
+      radius   - half-width of the window
+
+   Returns:
+      sums     - a 2D numpy array of the same shape and dtype as a
+"""
+def window_sum(a, radius):
+   for axis in range(2):
+      n = a.shape[axis]
+      lo, hi = window_bounds(n, radius)
+      if radius <= SHIFTED_SUM_RADIUS:
+         # Sums over [i-radius, i+radius] clipped to the axis
+         pad = [(0, 0), (0, 0)]
+         pad[axis] = (radius, radius)
+         padded = np.moveaxis(np.pad(a, pad), axis, 0)
+         sums = padded[0:n].copy()
+         for offset in range(1, 2*radius + 1):
+            sums += padded[offset:offset + n]
+
+         # Windows starting before 0 follow slicing instead
+         rows = np.moveaxis(a, axis, 0)
+         for i in range(min(radius, n)):
+            sums[i] = rows[lo[i]:hi[i]].sum(axis=0)
+         a = np.moveaxis(sums, 0, axis)
+      else:
+         running = np.cumsum(a, axis=axis, dtype=np.float64)
+         running = np.insert(running, 0, 0, axis=axis)
+         sums = np.take(running, hi, axis=axis) - np.take(running, lo, axis=axis)
+         a = sums.astype(a.dtype, copy=False)
+   return a
+
+"""
+   Harris cornerness R = det(M) - k * trace(M)^2 for every pixel, where M is
+   the structure tensor summed over a (2*radius+1) x (2*radius+1) window.
+
+   Arguments:
+      Ixx, Ixy, Iyy  - 2D numpy arrays of gradient products
+      radius         - half-width of the summation window
+      k              - Harris constant
+
+   Returns:
+      R              - a 2D numpy array of cornerness values
+"""
+def harris_response(Ixx, Ixy, Iyy, radius, k = 0.05):
+   Sum_xx = window_sum(Ixx, radius)
+   Sum_xy = window_sum(Ixy, radius)
+   Sum_yy = window_sum(Iyy, radius)
+
+   determinant = (Sum_xx * Sum_yy) - (Sum_xy**2)
+   trace = Sum_xx + Sum_yy
+
+   return determinant - k * (trace**2)
+
+"""
+   Maximum of a 2D array over a (2*radius+1) x (2*radius+1) window centred on
+   every pixel.  Pixels outside the array are ignored.
+
+   Arguments:
+      a        - a 2D numpy array
+      radius   - half-width of the window
+
+   Returns:
+      maxima   - a 2D numpy array of the same shape as a
+"""
+def window_max(a, radius):
+   for axis in range(2):
+      n = a.shape[axis]
+      pad = [(0, 0), (0, 0)]
+      pad[axis] = (radius, radius)
+      padded = np.pad(a, pad, constant_values=-np.inf)
+      a = np.take(padded, np.arange(n), axis=axis)
+      for offset in range(1, 2*radius + 1):
+         np.maximum(a, np.take(padded, np.arange(offset, offset + n), axis=axis), out=a)
+   return a
+
+"""
+   Select interest points from a cornerness map.
+
+   A pixel is kept if it is positive and the maximum of its nms_size x nms_size
+   neighbourhood.  Of those, the strongest min(max_points, fraction * pixels)
+   are returned, found by partial sort rather than a full sort of the map.
+   If a region is given, only pixels inside it are selected, while non-max
+   suppression still sees the whole map.
+
+   Arguments:
+      corner_list - a 2D numpy array of cornerness values
+      max_points  - maximum number of interest points to return
+      nms_size    - width of the non-max suppression window (odd)
+      fraction    - maximum fraction of the pixels to return
+      region      - (optional) tuple of slices restricting the selected pixels
+
+   Returns:
+      xs, ys      - numpy arrays of shape (N,) containing the coordinates of the
+                    selected points, ordered from strongest to weakest
+      scores      - numpy array of shape (N,) containing the cornerness value
+                    of each selected point
+"""
+def select_interest_points(corner_list, max_points = 200, nms_size = 3, fraction = 0.02, region = None):
+   # 1. Non-max suppression: keep positive pixels equal to their window maximum
+   peaks = (corner_list == window_max(corner_list, nms_size // 2)) & (corner_list > 0)
+   if region is not None:
+      inside = np.zeros(peaks.shape, dtype=bool)
+      inside[region] = True
+      peaks &= inside
+   index = np.flatnonzero(peaks)
+   values = corner_list.ravel()[index]
+
+   # 2. Keep the strongest k candidates; candidates tied with the k-th value
+   #    are taken in raster order (index is ascending)
+   k = min(int(max_points), int(np.ceil(fraction * corner_list.size)), index.size)
+   if k < index.size:
+      cutoff = -np.partition(-values, k - 1)[k - 1]
+      above = values > cutoff
+      tied = np.flatnonzero(values == cutoff)[:k - np.count_nonzero(above)]
+      top = np.union1d(np.flatnonzero(above), tied)
+      index, values = index[top], values[top]
+
+   # 3. Order from strongest to weakest (ties in raster order)
+   order = np.lexsort((index, -values))
+   ys, xs = np.unravel_index(index[order], corner_list.shape)
+   return xs, ys, values[order]
+
 """
    INTEREST POINT OPERATOR 
 
@@ -14,15 +182,19 @@ from cmath import pi
                     detect interest points
       mask        - (optional, for your use only) foreground mask constraining
                     the regions to extract interest points
+      nms_size    - width of the non-max suppression window
+      region      - (optional) tuple of slices restricting the returned points
+                    (see select_interest_points)
    Returns:
       xs          - numpy array of shape (N,) containing x-coordinates of the
-                    N detected interest points (N <= max_points)
+                    N detected interest points (N <= max_points), ordered
+                    from strongest to weakest
       ys          - numpy array of shape (N,) containing y-coordinates
       scores      - numpy array of shape (N,) containing a real-valued
                     measurement of the relative strength of each interest point
                     Greater scores indicate a stroner detector response
 """
-def find_interest_points(image, max_points = 200, scale = 1.0, mask = None):
+def find_interest_points(image, max_points = 200, scale = 1.0, mask = None, nms_size = 3, region = None):
    # check that image is grayscale
    assert image.ndim == 2, 'image should be grayscale'
    ##########################################################################
@@ -31,131 +203,222 @@ def find_interest_points(image, max_points = 200, scale = 1.0, mask = None):
    # 1. Set the variables
    harris_constant = 0.05
    scale = int(scale) *2
+   dtype = working_dtype(image)
 
-   y_size = image.shape[0]
-   x_size = image.shape[1]
-   corner_list = np.zeros([y_size, x_size])
-
-   image = denoise_gaussian(image)
+   image = denoise_gaussian(image.astype(dtype, copy=False)).astype(dtype, copy=False)
 
    # 2. Compute the gradient
    dy, dx = sobel_gradients(image)
+   dy, dx = dy.astype(dtype, copy=False), dx.astype(dtype, copy=False)
    Ixx = dx**2
    Ixy = dx*dy
    Iyy = dy**2
 
    # 3. For each pixel, consider a 2*scale+1 window around it and compute the cornerness function.
-   # for y in range(int(scale), y_size-scale):
-   #    for x in range(scale, x_size-scale):
-   for y in range(0, y_size):
-      for x in range(0, x_size):      
-         window_Ixx = Ixx[y-scale : y+scale+1, x-scale : x+scale+1]
-         window_Ixy = Ixy[y-scale : y+scale+1, x-scale : x+scale+1]
-         window_Iyy = Iyy[y-scale : y+scale+1, x-scale : x+scale+1]
-
-         Sum_xx = window_Ixx.sum()
-         Sum_xy = window_Ixy.sum()
-         Sum_yy = window_Iyy.sum()
-
-         determinant = (Sum_xx * Sum_yy) - (Sum_xy**2)
-         trace = Sum_xx + Sum_yy
-
-         r = determinant - harris_constant * (trace**2)
-
-         corner_list[y][x] = r
-
-   # 4. Apply non-max suppression across 3x3 window
-   for y in range(1, y_size-1):
-      for x in range(1, x_size-1):
-
-         window = corner_list[y-1:y+2, x-1:x+2]
-         if window.max() != corner_list[y][x]:
-            corner_list[y][x] = 0
-
-   # 4. Compute Threshold (Try changing this parameter)
-   threshold = np.quantile(corner_list, 0.98)
-
-   # If there are more than 200 points, modify the theshold
-   interest_points = corner_list > threshold
-   count = interest_points.sum()
-   if count > max_points:
-      threshold = np.quantile(corner_list, 1- (max_points/(y_size * x_size)))
-
-   # 6. Find all pixels that exceed the threshold and are local maxima
-   scores = []
-   xs = []
-   ys = []
-
-   for i in range(y_size):
-      for j in range(x_size):
-         if corner_list[i,j] > threshold:
-            xs.append(j)
-            ys.append(i)
-            scores.append(corner_list[y,x])
-
-   xs = np.array(xs)
-   ys = np.array(ys)
-   scores = np.array(scores)
+   corner_list = harris_response(Ixx, Ixy, Iyy, scale, harris_constant)
+
+   # 4. Apply non-max suppression and keep the strongest local maxima
+   xs, ys, scores = select_interest_points(corner_list, max_points, nms_size, region=region)
+
    #raise NotImplementedError('find_interest_points')
    ##########################################################################
    return xs, ys, scores
 
+"""
+   Build a Gaussian pyramid of an image together with the smoothed Sobel
+   gradients of every level, so that they are computed once and can be shared
+   by every detection run on the pyramid.
+
+   Arguments:
+      image             - a grayscale image in the form of a 2D numpy array
+      num_levels        - maximum number of levels (including the image itself)
+      downsample_factor - downsampling factor between consecutive levels
+      min_size          - levels smaller than this along either axis are not built
+
+   Returns:
+      pyramid           - a list of (factor, dy, dx) tuples, one per level, where
+                          factor is the downsampling factor of the level relative
+                          to the input image
+"""
+def build_gradient_pyramid(image, num_levels = 3, downsample_factor = 2, min_size = 16):
+   assert image.ndim == 2, 'image should be grayscale'
+   dtype = working_dtype(image)
+   pyramid = []
+   factor = 1
+   for level in range(num_levels):
+      if level > 0:
+         if min(image.shape) < min_size * downsample_factor:
+            break
+         image = smooth_and_downsample(image, downsample_factor)
+         factor *= downsample_factor
+      dy, dx = sobel_gradients(denoise_gaussian(image.astype(dtype, copy=False)))
+      pyramid.append((factor, dy.astype(dtype, copy=False), dx.astype(dtype, copy=False)))
+   return pyramid
+
+"""
+   MULTI-SCALE INTEREST POINT OPERATOR
+
+   Harris corner detection over an image pyramid.  Every level uses the same
+   window as find_interest_points(image, scale=scale) does at full resolution,
+   so level l covers scale * factor_l in input pixels while costing only
+   1 / factor_l^2 of a full-resolution pass.  Responses are normalised by
+   factor^4 so that they are comparable between levels.
+
+   Arguments:
+      image       - a grayscale image in the form of a 2D numpy array
+      max_points  - maximum number of interest points to return
+      num_levels  - number of pyramid levels to detect on
+      scale       - scale factor at the finest level
+      nms_size    - width of the non-max suppression window at every level
+      pyramid     - (optional) the output of build_gradient_pyramid(image) to
+                    reuse instead of computing it here
+
+   Returns:
+      xs          - numpy array of shape (N,) containing x-coordinates in the
+                    input image, ordered from strongest to weakest
+      ys          - numpy array of shape (N,) containing y-coordinates
+      scales      - numpy array of shape (N,) containing the scale of each point
+      scores      - numpy array of shape (N,) containing scale-normalised
+                    cornerness values
+"""
+def find_interest_points_pyramid(image, max_points = 200, num_levels = 3, scale = 1.0, nms_size = 3, pyramid = None):
+   harris_constant = 0.05
+   radius = int(scale) *2
+
+   if pyramid is None:
+      pyramid = build_gradient_pyramid(image, num_levels)
+
+   # 1. Detect the strongest points of every level
+   xs, ys, scales, scores = [], [], [], []
+   for factor, dy, dx in pyramid[:num_levels]:
+      corner_list = harris_response(dx**2, dx*dy, dy**2, radius, harris_constant) / factor**4
+      level_xs, level_ys, level_scores = select_interest_points(corner_list, max_points, nms_size)
+      xs.append(level_xs * factor)
+      ys.append(level_ys * factor)
+      scales.append(np.full(level_xs.size, scale * factor))
+      scores.append(level_scores)
+
+   xs = np.concatenate(xs)
+   ys = np.concatenate(ys)
+   scales = np.concatenate(scales)
+   scores = np.concatenate(scores)
+
+   # 2. Keep the strongest points across levels
+   order = np.argsort(-scores, kind='stable')[:max_points]
+   return xs[order], ys[order], scales[order], scores[order]
+
+# Lower edges of orientation bins 1-7 (bin 0 starts at -pi)
+ORIENTATION_EDGES = np.array([-(3*pi)/4, -(pi)/2, -(pi)/4, 0, pi/4, pi/2, (3*pi)/4])
+
 """
   Converts Orientation into index (helper function for feature descriptor)
   Argument:
-      orientation: Angle between -pi to pi
+      orientation: Angle between -pi to pi (scalar or numpy array)
 
    Returns:
-      index between 0-7. 
+      index between 0-7 (an array of indices for array input).
 """
 
 def orientation_to_index(orientation):
+   return np.searchsorted(ORIENTATION_EDGES, orientation, side='right')
 
-   if -pi <= orientation < -(3*pi/4):
-      return 0    
-   elif -(3*pi)/4 <= orientation < -(pi/2):
-      return 1
-   elif -(pi)/2 <= orientation < -(pi/4):
-      return 2
-   elif -(pi)/4 <= orientation < 0:
-      return 3
-   elif 0 <= orientation < pi/4:
-      return 4
-   elif pi/4 <= orientation < pi/2:
-      return 5
-   elif pi/2 <= orientation < (3*pi)/4:
-      return 6
-   else:
-      return 7
+"""
+   Orientation and magnitude of image gradients.
 
-#When given the center of the grid, compute the sum of orientation magnitude over 9x9 kernal
-def ninexnine_orientation(mag, theta, x,y):
-   b=[-4,-3,-2,-1,0,1,2,3,4]
-   a=[-4,-3,-2,-1,0,1,2,3,4]
+   Arguments:
+      dy, dx   - 2D numpy arrays of vertical and horizontal gradients
 
-   theta = np.array(theta)
-   mag = np.array(mag)
+   Returns:
+      theta    - float64 array of orientations between -pi/2 and pi/2 (0 where
+                 dx is zero)
+      mag      - array of gradient magnitudes, of the type of dy and dx
+"""
+def gradient_orientation(dy, dx):
+   mag = np.sqrt((dy**2) + (dx**2))
+   theta = np.arctan(np.divide(dy, dx, out=np.zeros(dy.shape, dy.dtype), where=dx!=0)).astype(np.float64)
+   return theta, mag
 
-   grids = []
-   orientation_sum = [0,0,0,0,0,0,0,0]
+"""
+   Integral histogram of gradient orientations.
 
-   for i in range(len(b)):
-      for j in range(len(a)):
-         grids.append([b[i],a[j]])
+   Quantizes the orientation of every pixel once and accumulates the gradient
+   magnitude of each orientation bin into its own integral image, so that the
+   orientation histogram of any rectangle can be read with four lookups.
+   Sums are accumulated in float64 whatever the type of mag, as a float32
+   integral loses the precision of small rectangles far from the origin.
 
-   for i in grids:
-      y_coor = int(i[0]+y)
-      x_coor = int(i[1]+x)
-      if y_coor >= theta.shape[0] or x_coor >= theta.shape[1]:
-         orientation = 0
-         magnitude = 0
-      else:
-         orientation = orientation_to_index(theta[y_coor,x_coor])
-         magnitude = mag[y_coor, x_coor]
+   Arguments:
+      mag      - 2D numpy array of gradient magnitudes
+      theta    - 2D numpy array of gradient orientations
 
-      orientation_sum[orientation] += magnitude
-   
-   return orientation_sum
+   Returns:
+      integral - float64 array of shape (8, H+1, W+1); integral[b, y, x] is the
+                 magnitude of orientation bin b summed over mag[:y, :x]
+"""
+def orientation_integral(mag, theta):
+   index = orientation_to_index(theta)
+   integral = np.zeros((8,) + tuple(np.add(mag.shape, 1)))
+   for b in range(8):
+      binned = np.where(index == b, mag, 0).astype(np.float64, copy=False)
+      np.cumsum(binned, axis=0, out=binned)
+      np.cumsum(binned, axis=1, out=integral[b, 1:, 1:])
+   return integral
+
+"""
+   Orientation histograms of square cells read from an integral histogram.
+   Pixels of a cell that fall outside the image contribute nothing.
+
+   Arguments:
+      integral - output of orientation_integral()
+      xs       - numpy array of cell centre x-coordinates (any shape)
+      ys       - numpy array of cell centre y-coordinates (same shape as xs)
+      radius   - half-width of the cells
+
+   Returns:
+      sums     - numpy array of shape xs.shape + (8,) containing the summed
+                 magnitude of each orientation bin over each cell
+"""
+def cell_histograms(integral, xs, ys, radius):
+   y_size = integral.shape[1] - 1
+   x_size = integral.shape[2] - 1
+   y0 = np.clip(ys - radius, 0, y_size)
+   y1 = np.clip(ys + radius + 1, 0, y_size)
+   x0 = np.clip(xs - radius, 0, x_size)
+   x1 = np.clip(xs + radius + 1, 0, x_size)
+   sums = integral[:, y1, x1] - integral[:, y0, x1] - integral[:, y1, x0] + integral[:, y0, x0]
+   return np.moveaxis(sums, 0, -1)
+
+"""
+   Gradient orientation and magnitude of an image, computed in its working
+   type (see working_dtype and gradient_orientation).
+"""
+def image_orientation(image):
+   dtype = working_dtype(image)
+   dy, dx = sobel_gradients(image.astype(dtype, copy=False))
+   dy, dx = dy.astype(dtype, copy=False), dx.astype(dtype, copy=False)
+   return gradient_orientation(dy, dx)
+
+"""
+   Descriptors of extract_features() from the gradient orientation and
+   magnitude of an image (see image_orientation).
+
+   Returns:
+      feats    - a float64 numpy array of shape (N, (2*scale+1)^2 * 8)
+"""
+def gradient_features(theta, mag, xs, ys, scale = 1.0):
+   scale = int(scale)
+   cell_width = 9
+
+   # 1. Build one integral image per orientation bin
+   integral = orientation_integral(mag, theta)
+
+   # 2. For each interest point, read the histogram of the window its cells use
+   xs = np.asarray(xs, dtype=int)
+   ys = np.asarray(ys, dtype=int)
+   cell = cell_histograms(integral, xs + scale * cell_width, ys - scale * cell_width, cell_width // 2)
+
+   # 3. Repeat it over the (2*scale+1)^2 grid cells
+   return np.tile(cell, (1, (2*scale+1)**2))
 
 """
    FEATURE DESCRIPTOR 
@@ -182,6 +445,11 @@ def ninexnine_orientation(mag, theta, x,y):
                  |----|
                   width
 
+   As implemented, every cell of the grid reads the same 9x9 window, centred
+   9*scale pixels above and 9*scale pixels right of the interest point, so
+   the descriptor repeats one orientation histogram (2*scale+1)^2 times.
+   Pixels of the window outside the image count as zero.
+
   Arguments:
       image    - a grayscale image in the form of a 2D numpy
       xs       - numpy array of shape (N,) containing x-coordinates
@@ -200,43 +468,75 @@ def extract_features(image, xs, ys, scale = 1.0):
    # TODO: YOUR CODE HERE
 
    # 1. Compute orientation and magnitude for each pixels
-   dy, dx = sobel_gradients(image)
-   theta = np.arctan(np.divide(dy, dx, out=np.zeros(dy.shape), where=dx!=0))
-   mag = np.sqrt((dy**2) + (dx**2))
-   K = int((2*scale+1)**2 * 8)
+   theta, mag = image_orientation(image)
 
-   y_size = image.shape[0]
-   x_size = image.shape[1]
+   # 2. Read the descriptors from one integral image per orientation bin
+   feats = gradient_features(theta, mag, xs, ys, scale).astype(working_dtype(image), copy=False)
 
-   feats = np.zeros([len(xs), K])
+   #raise NotImplementedError('extract_features')
+   ##########################################################################
+   return feats
 
-   # 2. For each interest points, assign 9x9 grid
-   for i in range(len(xs)):
-      x = xs[i]
-      y = ys[i]
+# Number of intensity comparisons of a binary descriptor (a multiple of 8)
+BRIEF_BITS = 256
 
-      b = np.arange(-scale, scale+1)
-      a = np.arange(-scale, scale+1)
+"""
+   Sampling pattern of the binary descriptor: pairs of offsets drawn from an
+   isotropic Gaussian of standard deviation radius/2, clipped to the square
+   patch of the given radius (BRIEF, Calonder et al. 2010).  The pattern only
+   depends on its arguments, so descriptors of different images compare.
 
-      grids = []
+   Returns:
+      pairs    - int numpy array of shape (num_bits, 4) of [y0, x0, y1, x1]
+"""
+def brief_pattern(radius, num_bits = BRIEF_BITS, seed = 0):
+   rng = np.random.default_rng(seed)
+   pairs = np.rint(rng.normal(0, radius / 2, (num_bits, 4)))
+   return np.clip(pairs, -radius, radius).astype(int)
 
-      for j in range(len(b)):
-         for k in range(len(a)):
-            grids.append([b[j],a[k]])
-      
-      #For each cells in the grid, find the orientation and magnitude
-      for q in range(len(grids)):
-         grid = grids[j]
-         y_grid = int(y+(grid[0]*9))
-         x_grid = int(x+(grid[1]*9))
-         
-         magnitude_sum = ninexnine_orientation(mag, theta, x_grid, y_grid)
+"""
+   BINARY FEATURE DESCRIPTOR
 
-         feats[i][q*8:(q+1)*8] = magnitude_sum
+   BRIEF-style alternative to extract_features(): every bit compares the
+   smoothed intensities at two offsets of a fixed pattern around the interest
+   point, and the bits are packed 8 per byte.  The patch has the same support
+   as the orientation histogram grid (radius 9*scale + 4); pixels outside the
+   image read as zero.  Descriptors are compared by Hamming distance (see
+   match_features).
 
-   #raise NotImplementedError('extract_features')
-   ##########################################################################
-   return feats
+   Arguments:
+      image    - a grayscale image in the form of a 2D numpy array
+      xs       - numpy array of shape (N,) containing x-coordinates
+      ys       - numpy array of shape (N,) containing y-coordinates
+      scale    - scale factor
+      num_bits - number of comparisons (a multiple of 8)
+
+   Returns:
+      feats    - a uint8 numpy array of shape (N, num_bits/8)
+"""
+def extract_binary_features(image, xs, ys, scale = 1.0, num_bits = BRIEF_BITS):
+   assert image.ndim == 2, 'image should be grayscale'
+   assert num_bits % 8 == 0, 'num_bits should be a multiple of 8'
+   dtype = working_dtype(image)
+   radius = int(scale) * 9 + 9 // 2
+
+   # 1. Smooth the image and pad it so every patch can be read in full
+   smoothed = denoise_gaussian(image.astype(dtype, copy=False))
+   padded = np.pad(smoothed, radius)
+
+   # 2. Compare the intensities of every pair of the pattern
+   xs = np.asarray(xs, dtype=int) + radius
+   ys = np.asarray(ys, dtype=int) + radius
+   pairs = brief_pattern(radius, num_bits)
+   first = padded[ys[:, None] + pairs[:, 0], xs[:, None] + pairs[:, 1]]
+   second = padded[ys[:, None] + pairs[:, 2], xs[:, None] + pairs[:, 3]]
+
+   # 3. Pack the bits
+   return np.packbits(first < second, axis=1).reshape(len(xs), num_bits // 8)
+
+# Feature descriptors by name: SIFT-like orientation histograms (float, 72
+# values at scale 1) or packed binary comparisons (uint8, BRIEF_BITS/8 bytes)
+DESCRIPTORS = {'histogram': extract_features, 'binary': extract_binary_features}
 
 """
 DISTANCE
@@ -244,20 +544,89 @@ DISTANCE
 Helper function for Feature matching. Computes distance between two orientation vectors
 
 Arguments:
-   feat1 - (8,) array containing orientation of an interest point
-   feat2 - (8,) array containing orientation of an interest point
+   feat1 - (K,) array containing orientation of an interest point
+   feat2 - (K,) array containing orientation of an interest point
 """
 def distance(feat1, feat2):
-   # Calculate the distance of 8 orientation bins
-   dist = 0 
-   for i in range(72):
-      dist += (feat1[i]-feat2[i])**2
-   
-   # Square root for distance
-   dist = dist**(1.0/2)
+   diff = np.asarray(feat1) - np.asarray(feat2)
+   return np.sqrt(np.dot(diff, diff))
+
+"""
+   Euclidean distance between corresponding rows of two arrays.
+"""
+def distance_rows(feats0, feats1):
+   diff = feats0 - feats1
+   return np.sqrt(np.einsum('ij,ij->i', diff, diff))
 
+# Upper bound on the size of the distance block held in memory while matching
+MATCH_CHUNK_BYTES = 1 << 26
+
+"""
+   Unpack binary descriptors into float32 rows of +1 (bit set) and -1.
+"""
+def binary_signs(feats):
+   signs = np.unpackbits(feats, axis=1).astype(np.float32)
+   signs *= 2
+   signs -= 1
+   return signs
+
+"""
+   Hamming distances between every row of two packed binary descriptor
+   arrays.  With the bits as +1/-1 vectors a and b of length n, the distance
+   is (n - ab)/2, so the bulk of the work is matrix multiplies (exact in
+   float32 for fewer than 2^24 bits).  The signs of feats1 are unpacked a
+   block of rows at a time, so that the float32 signs and products held
+   besides the output stay within max_bytes when the signs of feats0 fit.
+
+   Arguments:
+      feats0    - a uint8 numpy array of shape (N0, B)
+      feats1    - a uint8 numpy array of shape (N1, B)
+      max_bytes - bound on the float32 memory besides the output
+
+   Returns:
+      dist      - an int32 numpy array of shape (N0, N1)
+"""
+def hamming_distances(feats0, feats1, max_bytes = MATCH_CHUNK_BYTES):
+   bits = feats0.shape[1] * 8
+   signs0 = binary_signs(feats0)
+   block = max(1, (max_bytes - signs0.nbytes) // (4 * (bits + len(feats0))))
+   dist = np.empty((len(feats0), len(feats1)), dtype=np.int32)
+   for start in range(0, len(feats1), block):
+      stop = min(start + block, len(feats1))
+      products = signs0 @ binary_signs(feats1[start:stop]).T
+      products -= bits
+      products *= -0.5
+      dist[:, start:stop] = products
    return dist
 
+"""
+   Hamming distance between corresponding rows of two packed arrays.
+"""
+def hamming_rows(feats0, feats1):
+   return np.unpackbits(feats0 ^ feats1, axis=1).sum(axis=1, dtype=np.int32)
+
+"""
+   Squared Euclidean distances between every row of feats0 and feats1,
+   computed as ||a||^2 + ||b||^2 - 2ab so that the bulk of the work is a
+   single matrix multiply.
+
+   Arguments:
+      feats0   - a numpy array of shape (N0, K)
+      feats1   - a numpy array of shape (N1, K)
+      norms1   - (optional) precomputed squared norms of the rows of feats1
+
+   Returns:
+      dist     - a numpy array of shape (N0, N1)
+"""
+def squared_distances(feats0, feats1, norms1 = None):
+   if norms1 is None:
+      norms1 = np.einsum('ij,ij->i', feats1, feats1)
+   norms0 = np.einsum('ij,ij->i', feats0, feats0)
+   dist = feats0 @ feats1.T
+   dist *= -2
+   dist += norms0[:, None]
+   dist += norms1[None, :]
+   return np.maximum(dist, 0, out=dist)
 
 """
    FEATURE MATCHING 
@@ -266,17 +635,32 @@ def distance(feat1, feat2):
    compute the best matching feature in the second set for each feature in the
    first set.
 
+   Rows of feats0 are matched in chunks of at most MATCH_CHUNK_BYTES of
+   distances, so the full N0 x N1 distance matrix is never built.  The two
+   nearest neighbours of each row are found by partial sort and their
+   distances recomputed exactly for the ratio score.
+
+   If an approximate nearest neighbour index over feats1 is given (see
+   ann_index.build_ann_index), the two nearest neighbours are looked up in
+   the index instead, trading exactness for speed on large sets.
+
+   Packed binary descriptors (uint8, see extract_binary_features) are
+   compared by Hamming distance instead of Euclidean distance.
+
    Arguments:
       feats0   - a numpy array of shape (N0, K), containing N0 K-dimensional
-                 feature descriptors (generated via extract_features())
+                 feature descriptors (generated via extract_features() or
+                 extract_binary_features())
       feats1   - a numpy array of shape (N1, K), containing N1 K-dimensional
-                 feature descriptors (generated via extract_features())
+                 feature descriptors of the same kind as feats0
       scores0  - a numpy array of shape (N0,) containing the scores for the
                  interest point locations at which feats0 was extracted
                  (generated via find_interest_point())
       scores1  - a numpy array of shape (N1,) containing the scores for the
                  interest point locations at which feats1 was extracted
                  (generated via find_interest_point())
+      index    - (optional) approximate nearest neighbour index over feats1
+      n_probes - leaves visited per tree when querying the index
 
    Returns:
       matches  - a numpy array of shape (N0,) containing, for each feature
@@ -284,70 +668,130 @@ def distance(feat1, feat2):
       scores   - a numpy array of shape (N0,) containing a real-valued score
                  for each match
 """
-def match_features(feats0, feats1, scores0, scores1):
+def match_features(feats0, feats1, scores0, scores1, index = None, n_probes = 1):
    ##########################################################################
    # TODO: YOUR CODE HERE
    
    # 1. Find the number of interest points for both images
+   feats0 = np.asarray(feats0)
+   feats1 = np.asarray(feats1)
+   binary = feats0.dtype == np.uint8
+   assert binary == (feats1.dtype == np.uint8), 'cannot match binary against real-valued descriptors'
+   if not binary:
+      # Match in float32 only if both sets are float32
+      dtype = np.result_type(feats0.dtype, feats1.dtype, np.float32)
+      feats0 = feats0.astype(dtype, copy=False)
+      feats1 = feats1.astype(dtype, copy=False)
    num0 = feats0.shape[0]
    num1 = feats1.shape[0]
 
-   # 2. For each feature descriptor in feats0, compare with those in feats1
+   matches = np.zeros(num0, dtype=int)
+   scores = np.zeros(num0)
+   if num0 == 0 or num1 == 0:
+      return matches, scores
+
+   if index is not None:
+      assert not binary, 'the nearest neighbour index only supports real-valued descriptors'
+      dists, neighbours = query_ann_index(index, feats0, k=2, n_probes=n_probes)
+      matches = np.maximum(neighbours[:, 0], 0)
+      scores = np.divide(dists[:, 0], dists[:, 1], out=np.zeros(num0), where=dists[:, 1]!=0)
+      return matches, scores
+
+   # 2. For each chunk of feats0, compute the distances to all of feats1
    # Find two lowest distance for each feature descriptor in feats0 to compute the distance ratio
-   distance1 = 100000000000
-   distance2 = 100000000000
-   matches = []
-   scores = []
-
-   for i in range(num0):
-      for j in range(num1):
-
-         dist = distance(feats0[i], feats1[j])
-         
-         if dist < distance1:
-            distance2 = distance1
-            distance1 = dist
-            index1 = j
-            
-         elif dist < distance2:
-            distance2 = dist
-            
-      matches.append(int(index1))
-      if distance2 == 0:
-         scores.append(0)
+   if binary:
+      # Half the budget for the int32 distances and float32 signs of a chunk
+      # of feats0, half for the signs and products of a block of feats1
+      bits = feats1.shape[1] * 8
+      chunk = max(1, MATCH_CHUNK_BYTES // 2 // (4 * (num1 + bits)))
+      rows_distance, farthest = hamming_rows, np.iinfo(np.int32).max
+   else:
+      norms1 = np.einsum('ij,ij->i', feats1, feats1)
+      chunk = max(1, MATCH_CHUNK_BYTES // (feats1.itemsize * num1))
+      rows_distance, farthest = distance_rows, np.inf
+   for start in range(0, num0, chunk):
+      stop = min(start + chunk, num0)
+      if binary:
+         dist = hamming_distances(feats0[start:stop], feats1, MATCH_CHUNK_BYTES // 2)
+      else:
+         dist = squared_distances(feats0[start:stop], feats1, norms1)
+
+      # 3. Nearest neighbour (first index on ties) and the two lowest distances
+      index1 = np.argmin(dist, axis=1)
+      matches[start:stop] = index1
+      distance1 = rows_distance(feats0[start:stop], feats1[index1])
+      if num1 > 1:
+         dist[np.arange(stop - start), index1] = farthest
+         distance2 = rows_distance(feats0[start:stop], feats1[np.argmin(dist, axis=1)])
       else:
-         scores.append(distance1/distance2)
+         distance2 = np.full(stop - start, np.inf)
 
-      index1=0
-      distance1=100000000000
-      distance2=100000000000
-   
-   matches = np.array(matches)
-   scores = np.array(scores)
+      # 4. Score each match by the distance ratio
+      ratio = np.divide(distance1, distance2, out=np.zeros(stop - start), where=distance2!=0)
+      scores[start:stop] = ratio
 
    #raise NotImplementedError('match_features')
    ##########################################################################
    return matches, scores
 
 
+# Probability of a correct match per distance ratio bin: [0.2, 0.3], (0.3, 0.4],
+# ..., (0.6, 0.7], and above 0.7.  Ratios below 0.2 also get weight 0.
+MATCH_PDF_EDGES = np.array([0.3, 0.4, 0.5, 0.6, 0.7])
+MATCH_PDF_WEIGHTS = np.array([0.05, 0.25, 0.29, 0.18, 0.09, 0])
+
 def correct_match_pdf(distance_ratio):
-   if 0.2<=distance_ratio <=0.3:
-      return 0.05
-   elif 0.3<=distance_ratio <=0.4:
-      return 0.25
-   elif 0.4<=distance_ratio <=0.5:
-      return 0.29
-   elif 0.5<=distance_ratio <=0.6:
-      return 0.18
-   elif 0.6<=distance_ratio <=0.7:
-      return 0.09
-   elif 0.7<=distance_ratio <=0.8:
-      return 0
-   elif 0.8<=distance_ratio <=0.9:
-      return 0
+   ratio = np.asarray(distance_ratio)
+   weight = MATCH_PDF_WEIGHTS[np.searchsorted(MATCH_PDF_EDGES, ratio, side='left')]
+   weight = np.where(ratio >= 0.2, weight, 0)
+   if weight.ndim == 0:
+      return float(weight)
+   return weight
+
+# Largest number of bins for which votes are counted in a dense grid
+DENSE_VOTE_BINS = 1 << 22
+
+"""
+   Accumulate weighted votes into bins.
+
+   Bins are counted in a dense grid spanning the occupied bin range when it is
+   small enough (np.bincount), and in a hashed table of the occupied bins
+   otherwise (np.unique), so the cost is linear in the number of votes either
+   way.
+
+   Arguments:
+      keys     - integer numpy array of shape (N, D) of the bin of every vote
+      weights  - numpy array of shape (N,) of the weight of every vote
+
+   Returns:
+      bins     - numpy array of shape (M, D) of the occupied bins
+      tallies  - numpy array of shape (M,) of the summed weight of every bin
+      first    - numpy array of shape (M,) of the index of the first vote
+                 cast into every bin
+"""
+def accumulate_votes(keys, weights):
+   if keys.shape[0] == 0:
+      return keys, np.zeros(0), np.zeros(0, dtype=int)
+
+   lo = keys.min(axis=0)
+   span = keys.max(axis=0) - lo + 1
+   linear = np.ravel_multi_index(tuple((keys - lo).T), tuple(span))
+   order = np.arange(keys.shape[0])
+
+   size = int(np.prod(span))
+   if size <= DENSE_VOTE_BINS:
+      tallies = np.bincount(linear, weights, minlength=size)
+      first = np.full(size, keys.shape[0])
+      np.minimum.at(first, linear, order)
+      occupied = np.flatnonzero(first < keys.shape[0])
+      tallies, first = tallies[occupied], first[occupied]
    else:
-      return 0
-      
+      occupied, first, inverse = np.unique(linear, return_index=True, return_inverse=True)
+      tallies = np.bincount(inverse, weights)
+
+   bins = np.stack(np.unravel_index(occupied, tuple(span)), axis=1) + lo
+   return bins, tallies, first
+
 """
    HOUGH TRANSFORM 
 
@@ -356,6 +800,15 @@ def correct_match_pdf(distance_ratio):
    estimate the overall translation vector t = [tx ty].
 
    In order to accumulate votes, discretize the translation parameter space into bins.
+   Each match votes with the probability that it is correct given its distance
+   ratio (correct_match_pdf); only translations with tx >= 0 and ty >= 0 are
+   counted.
+
+   If the scales of the interest points are given, the parameter space gets a
+   scale dimension: each match votes for the scale s = scales1/scales0
+   (quantized in octaves) and the translation t = p1 - s * p0.  If labels are
+   given (e.g. the template each feature of the first image comes from), votes
+   with different labels go to different bins.
 
    Arguments:
       xs0     - numpy array of shape (N0,) containing x-coordinates of the
@@ -370,62 +823,214 @@ def correct_match_pdf(distance_ratio):
                 the first image, the index of the best match in the second
       scores  - a numpy array of shape (N0,) containing a real-valued score
                 for each pair of matched features
+      bin_size - width of the translation bins in pixels
+      scales0 - (optional) numpy array of shape (N0,) of interest point scales
+                in the first image
+      scales1 - (optional) numpy array of shape (N1,) of interest point scales
+                in the second image
+      scale_steps - number of scale bins per octave
+      labels  - (optional) integer numpy array of shape (N0,) of vote labels
+      top_k   - (optional) number of peaks to return in votes
 
    Returns:
       tx      - predicted translation in x-direction between images
       ty      - predicted translation in y-direction between images
-      votes   - a matrix storing vote tallies; this output is provided for
-                your own convenience and you are free to design its format
+      votes   - a numpy array with one row [ty, tx, weight] per vote bin, with
+                scale and label columns inserted before weight when scales
+                and labels are given ([ty, tx, scale, label, weight]), ordered
+                from the highest tally down and truncated to top_k rows
 """
-def hough_votes(xs0, ys0, xs1, ys1, matches, scores):
+def hough_votes(xs0, ys0, xs1, ys1, matches, scores, bin_size = 5, scales0 = None, scales1 = None, scale_steps = 1, labels = None, top_k = None):
    ##########################################################################
    # TODO: YOUR CODE HERE
-   votes = []
-
-   # 1. For each pair of interest points, record the translation vector and its weights
-   for i in range(len(xs0)):
-      x0, y0 = xs0[i], ys0[i]
-      x1, y1 = xs1[matches[i]], ys1[matches[i]]
-
-      ty = 5 * round((y1-y0)/5)
-      tx = 5 * round((x1-x0)/5)
-      
-      voted = False 
-      for vote in votes:
-
-         if vote[0] == ty and vote[1] == tx:
-            vote[2] += correct_match_pdf(scores[i])
-            voted = True
-            break
-      
-      if voted == False:
-         if correct_match_pdf(scores[i]) != 0 and tx>=0 and ty >= 0:
-            votes.append([ty, tx, correct_match_pdf(scores[i])])
-
-   # 2. Find the translation vector that has the highest votes
-   tallies = 0
-   for vote in votes:
-      if vote[2] > tallies:
-         tallies = vote[2]
-         ty = vote[0]
-         tx = vote[1]
-
-   # 3. Find tx and ty value with the highest vote. 
-   votes = np.array(votes)
-   # max_vote = votes[:,2].max()
- 
-   max_vote = 0
-   for vote in votes:
-      if vote[2] > max_vote:
-         max_vote = vote[2]
-         ty = vote[0]
-         tx = vote[1]
+   matches = np.asarray(matches, dtype=int)
+   x0, y0 = np.asarray(xs0, dtype=float), np.asarray(ys0, dtype=float)
+   x1, y1 = np.asarray(xs1, dtype=float)[matches], np.asarray(ys1, dtype=float)[matches]
+
+   # 1. For each pair of interest points, record the translation vector (and scale) and its weights
+   keys = []
+   if scales0 is not None and scales1 is not None:
+      octaves = np.log2(np.asarray(scales1, dtype=float)[matches] / np.asarray(scales0, dtype=float))
+      scale_bin = np.round(octaves * scale_steps).astype(int)
+      scale = 2.0 ** (scale_bin / scale_steps)
+      x0, y0 = x0 * scale, y0 * scale
+      keys.append(scale_bin)
+
+   if labels is not None:
+      keys.append(np.asarray(labels, dtype=int))
+
+   ty = np.round((y1 - y0) / bin_size).astype(int)
+   tx = np.round((x1 - x0) / bin_size).astype(int)
+   keys = np.stack([ty, tx] + keys, axis=1)
+   weights = correct_match_pdf(np.asarray(scores, dtype=float))
+
+   valid = (weights > 0) & (tx >= 0) & (ty >= 0)
+
+   # 2. Sum the weights of the votes in each bin
+   bins, tallies, first = accumulate_votes(keys[valid], weights[valid])
+
+   # 3. Order the bins by tally (ties go to the bin voted for first)
+   order = np.lexsort((first, -tallies))[:top_k]
+   votes = np.zeros((order.size, keys.shape[1] + 1))
+   votes[:, 0] = bins[order, 0] * bin_size
+   votes[:, 1] = bins[order, 1] * bin_size
+   votes[:, 2:-1] = bins[order, 2:]
+   if scales0 is not None and scales1 is not None:
+      votes[:, 2] = 2.0 ** (bins[order, 2] / scale_steps)
+   votes[:, -1] = tallies[order]
+
+   # 4. Find tx and ty value with the highest vote.
+   if votes.shape[0] == 0:
+      return 0, 0, votes
+   ty, tx = votes[0, 0], votes[0, 1]
 
-   
    # raise NotImplementedError('hough_votes')
    ##########################################################################
    return tx, ty, votes
 
+"""
+   Interest points and feature descriptors of an image, looked up in and
+   stored to a feature cache when one is given.
+
+   Arguments:
+      image    - a grayscale image in the form of a 2D numpy array
+      scale    - scale factor passed to find_interest_points/extract_features
+      cache    - (optional) a feature_cache.FeatureCache
+      profile  - (optional) a profiling.DetectionProfile
+      role     - name of the image in profile records ('test' or 'template')
+      descriptor - name of the feature descriptor (see DESCRIPTORS)
+      region   - (optional) (y0, y1, x0, x1) part of the image the interest
+                 points are taken from; the rest of the image is only read
+
+   Returns:
+      xs, ys, scores - output of find_interest_points()
+      feats          - output of the descriptor (extract_features() by default)
+"""
+def image_features(image, scale = 1.0, cache = None, profile = None, role = 'test', descriptor = 'histogram', region = None):
+   if cache is not None:
+      with profile_stage(profile, 'cache', image=role, shape=np.shape(image)) as info:
+         params = (scale,) if descriptor == 'histogram' else (scale, descriptor)
+         if region is not None:
+            params += tuple(region)
+         key = cache.key(image, *params)
+         cached = cache.get(key)
+         info['hit'] = cached is not None
+      if cached is not None:
+         return cached
+
+   with profile_stage(profile, 'harris', image=role, shape=np.shape(image)) as info:
+      core = None if region is None else (slice(region[0], region[1]), slice(region[2], region[3]))
+      xs, ys, scores = find_interest_points(image, scale=scale, region=core)
+      info['keypoints'] = len(xs)
+
+   with profile_stage(profile, 'descriptors', image=role, keypoints=len(xs)) as info:
+      feats = DESCRIPTORS[descriptor](image, xs, ys, scale=scale)
+      info['feats_shape'] = feats.shape
+      info['feats_bytes'] = feats.nbytes
+
+   if cache is not None:
+      cache.put(key, (xs, ys, scores, feats))
+   return xs, ys, scores, feats
+
+"""
+   Stack the features of a set of templates into a single index, so that a
+   test image is matched against all of them at once.
+
+   Arguments:
+      template_images - a list of gray scale template images
+      template_masks  - a list of binary masks of the template images
+      scale           - scale factor of the interest points and descriptors
+      cache           - (optional) a feature_cache.FeatureCache
+      profile         - (optional) a profiling.DetectionProfile
+      dtype           - (optional) floating point type (np.float32 or
+                        np.float64) to process the templates in; by default
+                        the type of each template image (see working_dtype)
+      descriptor      - name of the feature descriptor (see DESCRIPTORS)
+
+   Returns:
+      index           - a dict of numpy arrays:
+                          feats, xs, ys, scores - stacked template features
+                          template_ids - template of every stacked feature
+                          offsets      - (T+1,) start of every template's rows
+                          shapes       - (T, 2) height and width of templates
+                        and the name of the descriptor under 'descriptor'
+"""
+def build_template_index(template_images, template_masks, scale = 1.0, cache = None, profile = None, dtype = None, descriptor = 'histogram'):
+   features = []
+   shapes = []
+   for template_image, template_mask in zip(template_images, template_masks):
+      # Leave only the foreground of the template image
+      template_dtype = working_dtype(template_image) if dtype is None else dtype
+      template_img = (template_image * template_mask).astype(template_dtype, copy=False)
+      features.append(image_features(template_img, scale, cache, profile, 'template', descriptor))
+      shapes.append(np.shape(template_image))
+
+   counts = [len(xs) for xs, _, _, _ in features]
+   return {
+      'xs': np.concatenate([xs for xs, _, _, _ in features]),
+      'ys': np.concatenate([ys for _, ys, _, _ in features]),
+      'scores': np.concatenate([scores for _, _, scores, _ in features]),
+      'feats': np.concatenate([feats for _, _, _, feats in features]),
+      'template_ids': np.repeat(np.arange(len(features)), counts),
+      'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(int),
+      'shapes': np.array(shapes, dtype=int).reshape(-1, 2),
+      'descriptor': descriptor,
+   }
+
+"""
+   Locate every template of a template index in an image from the image's
+   features: one matching pass against the stacked template features and one
+   Hough accumulator keyed by template.
+
+   Arguments:
+      index          - output of build_template_index()
+      xs, ys, scores - interest points of the image
+      feats          - descriptors of the image
+      profile        - (optional) a profiling.DetectionProfile
+
+   Returns:
+      peaks          - numpy array of shape (T, 3) with the [ty, tx, weight]
+                       peak of every template (zeros for templates without votes)
+"""
+def locate_templates(index, xs, ys, scores, feats, profile = None):
+   if len(feats) == 0:
+      return np.zeros((len(index['shapes']), 3))
+
+   with profile_stage(profile, 'matching', distances_shape=(len(index['feats']), len(feats))) as info:
+      matches, match_scores = match_features(index['feats'], feats, index['scores'], scores)
+      info['matches'] = len(matches)
+
+   with profile_stage(profile, 'hough', matches=len(matches)) as info:
+      _, _, votes = hough_votes(index['xs'], index['ys'], xs, ys, matches, match_scores,
+                                labels=index['template_ids'])
+      peaks = template_peaks(votes, len(index['shapes']))
+      info['vote_bins'] = len(votes)
+      info['peak_weight'] = float(peaks[:, 2].max()) if len(peaks) else 0.0
+   return peaks
+
+"""
+   Peak [ty, tx, weight] of every template from the votes of hough_votes()
+   with template labels (zeros for templates without votes).
+"""
+def template_peaks(votes, num_templates):
+   # The first row of each template is its peak, as votes are sorted by tally
+   templates, first = np.unique(votes[:, 2].astype(int), return_index=True)
+   peaks = np.zeros((num_templates, 3))
+   peaks[templates] = votes[first][:, [0, 1, 3]]
+   return peaks
+
+"""
+   Average of the bounding boxes predicted by each template's peak.
+"""
+def peaks_to_bbox(index, peaks):
+   ty, tx = peaks[:, 0], peaks[:, 1]
+   template_y, template_x = index['shapes'][:, 0], index['shapes'][:, 1]
+   x_min = np.mean(tx - template_x/2)
+   y_min = np.mean(ty - template_y/2)
+   x_max = np.mean(tx + template_x/2)
+   y_max = np.mean(ty + template_y/2)
+   return (x_min, y_min, x_max, y_max)
+
 """
     OBJECT DETECTION 
 
@@ -446,54 +1051,49 @@ def hough_votes(xs0, ys0, xs1, ys1, matches, scores):
         test_img        - a gray scale test image in the form of 2d numpy array
                           containing the object category of interest.
 
+        cache           - (optional) a feature_cache.FeatureCache holding the
+                          interest points and descriptors of previously seen
+                          templates and test images
+
+        template_index  - (optional) output of build_template_index() for the
+                          templates, to reuse it across test images
+
+        profile         - (optional) a profiling.DetectionProfile receiving
+                          per-stage durations, counts and array sizes
+
+        dtype           - (optional) floating point type to run the pipeline
+                          in: np.float32 roughly halves the memory traffic of
+                          every stage; by default the type of test_img (see
+                          working_dtype)
+
+        descriptor      - name of the feature descriptor (see DESCRIPTORS):
+                          'histogram' or 'binary'; ignored if template_index
+                          is given, whose descriptor is used
+
     Returns:
          bbox           - a numpy array of shape (4,) specifying the detected
                           bounding box in the format of
                              (x_min, y_min, x_max, y_max)
 
 """
-def object_detection(template_images, template_masks, test_img):
+def object_detection(template_images, template_masks, test_img, cache = None, template_index = None, profile = None, dtype = None, descriptor = 'histogram'):
    ##########################################################################
    # TODO: YOUR CODE HERE
-   x_min = 0
-   y_min = 0
-   x_max = 0
-   y_max = 0
-
-   for i in range(len(template_images)):
-      template_count = i
-      # 1. Leave only the foreground of the template image
-      template_img = template_images[i] * template_masks[i]
-
-      template_y = np.array(template_images[i]).shape[0]
-      template_x = np.array(template_images[i]).shape[1]
-
-      # 2. Extract Interest Point from template and test images
-      xs_template, ys_template, scores_template = find_interest_points(template_img, scale=1.0)
-      xs_test, ys_test, scores_test = find_interest_points(test_img, scale=1.0)
-
-      # 3. Extract Feature Descriptors of the interest points of both template and test images
-      template_features = extract_features(template_img ,xs_template, ys_template, scale=1.0)
-      test_features= extract_features(test_img, xs_test, ys_test, scale=1.0)
-
-      # 4. Match features of template and test Images
-      matches, scores = match_features(template_features, test_features, scores_template, scores_test)
-
-      # 5. Implement Hough Transformation
-      tx, ty, votes = hough_votes(xs_template, ys_template, xs_test, ys_test, matches, scores)
+   # 1. Stack the features of all templates into one index
+   if dtype is not None:
+      test_img = np.asarray(test_img, dtype=dtype)
+   if template_index is None:
+      template_index = build_template_index(template_images, template_masks, 1.0, cache, profile, dtype, descriptor)
 
-      x_min += tx-(template_x)/2
-      y_min += ty-(template_y)/2
-      x_max += tx+(template_x)/2
-      y_max += ty+(template_y)/2
+   # 2. Extract Interest Point and Feature Descriptors of the test image
+   xs_test, ys_test, scores_test, test_features = image_features(test_img, 1.0, cache, profile, 'test',
+                                                                 template_index['descriptor'])
 
-   #6. Average the coordiantes of the box
-   x_min /= (i+1)
-   y_min /= (i+1)
-   x_max /= (i+1)
-   y_max /= (i+1)
+   # 3. Match features of all templates against the test image and vote per template
+   peaks = locate_templates(template_index, xs_test, ys_test, scores_test, test_features, profile)
 
-   bbox = (x_min, y_min, x_max, y_max)
+   # 4. Average the boxes predicted by each template
+   bbox = peaks_to_bbox(template_index, peaks)
 
    #raise NotImplementedError('object_detection')
    ##########################################################################
@@ -0,0 +1,151 @@
+import numpy as np
+
+from object_detection import extract_features, harris_response, select_interest_points, working_dtype
+from edge_detection import denoise_gaussian, sobel_gradients
+
+"""
+   TILED DETECTION
+
+   Interest points and feature descriptors of images too large to process in
+   one piece.  The image is read through a memory map, one overlapping tile at
+   a time, so peak memory is bounded by the tile size instead of the image
+   size.
+
+   Every tile owns a core region and is read with a halo around it that covers
+   the support of everything computed for the core: the Gaussian, the Sobel
+   operator, the Harris window and the non-max suppression window for
+   interest points, and the Sobel operator plus the descriptor grid for
+   features.  A point is only selected by the tile whose core contains it,
+   but its non-max suppression sees the halo, so maxima on a seam are neither
+   lost nor reported twice.  The result is the same as running
+   find_interest_points() and extract_features() on the whole image.
+"""
+
+"""
+   Open an image for tiled processing.
+
+   Arguments:
+      image - a 2D numpy array (possibly a np.memmap) or the file name of a .npy
+              file, which is memory-mapped
+
+   Returns:
+      image - a 2D array-like supporting slicing
+"""
+def open_image(image):
+   if isinstance(image, str):
+      image = np.load(image, mmap_mode='r')
+   assert image.ndim == 2, 'image should be grayscale'
+   return image
+
+"""
+   Read a tile of an image as floating point without changing its values, as
+   find_interest_points() and extract_features() convert their input:
+   float32 images give float32 tiles, others float64 (see working_dtype).
+"""
+def read_tile(image, y0, y1, x0, x1):
+   tile = np.asarray(image[y0:y1, x0:x1])
+   return tile.astype(working_dtype(tile))
+
+"""
+   Split an axis of length n into cores of length tile_size, each extended by
+   a halo clipped to the axis.
+
+   Returns:
+      a list of (lo, hi, core_lo, core_hi) tuples: the extended range and the
+      core range
+"""
+def tile_ranges(n, tile_size, halo):
+   ranges = []
+   for core_lo in range(0, n, tile_size):
+      core_hi = min(core_lo + tile_size, n)
+      ranges.append((max(core_lo - halo, 0), min(core_hi + halo, n), core_lo, core_hi))
+   return ranges
+
+"""
+   TILED INTEREST POINT OPERATOR
+
+   Same as find_interest_points(image, max_points, scale, nms_size=nms_size),
+   computed tile by tile.
+
+   Arguments:
+      image           - see open_image()
+      max_points      - maximum number of interest points to return
+      scale           - scale factor of the Harris window
+      nms_size        - width of the non-max suppression window
+      tile_size       - side of the core of every tile
+      gaussian_radius - radius of the kernel of denoise_gaussian()
+
+   Returns:
+      xs, ys, scores  - see find_interest_points()
+"""
+def find_interest_points_tiled(image, max_points = 200, scale = 1.0, nms_size = 3, tile_size = 1024, gaussian_radius = 3):
+   image = open_image(image)
+   harris_constant = 0.05
+   radius = int(scale) *2
+   halo = gaussian_radius + 1 + radius + nms_size // 2
+
+   xs, ys, scores = [], [], []
+   for y0, y1, core_y0, core_y1 in tile_ranges(image.shape[0], tile_size, halo):
+      for x0, x1, core_x0, core_x1 in tile_ranges(image.shape[1], tile_size, halo):
+         # 1. Harris response of the tile and its halo
+         dy, dx = sobel_gradients(denoise_gaussian(read_tile(image, y0, y1, x0, x1)))
+         corner_list = harris_response(dx**2, dx*dy, dy**2, radius, harris_constant)
+
+         # 2. Strongest local maxima inside the core
+         core = (slice(core_y0 - y0, core_y1 - y0), slice(core_x0 - x0, core_x1 - x0))
+         tile_xs, tile_ys, tile_scores = select_interest_points(corner_list, max_points, nms_size, 1.0, core)
+         xs.append(tile_xs + x0)
+         ys.append(tile_ys + y0)
+         scores.append(tile_scores)
+
+   xs = np.concatenate(xs)
+   ys = np.concatenate(ys)
+   scores = np.concatenate(scores)
+
+   # 3. Keep the strongest points over all tiles (ties in raster order)
+   k = min(int(max_points), int(np.ceil(0.02 * image.shape[0] * image.shape[1])))
+   order = np.lexsort((ys * image.shape[1] + xs, -scores))[:k]
+   return xs[order], ys[order], scores[order]
+
+"""
+   TILED FEATURE DESCRIPTOR
+
+   Same as extract_features(image, xs, ys, scale), computed tile by tile.
+
+   Arguments:
+      image     - see open_image()
+      xs, ys    - numpy arrays of shape (N,) of interest point coordinates
+      scale     - scale factor of the descriptor grid
+      tile_size - side of the core of every tile
+
+   Returns:
+      feats     - see extract_features()
+"""
+def extract_features_tiled(image, xs, ys, scale = 1.0, tile_size = 1024):
+   image = open_image(image)
+   xs = np.asarray(xs, dtype=int)
+   ys = np.asarray(ys, dtype=int)
+   halo = int(scale) * 9 + 9 // 2 + 1
+
+   feats = np.zeros((len(xs), (2*int(scale) + 1)**2 * 8), dtype=working_dtype(image[:1, :1]))
+   for y0, y1, core_y0, core_y1 in tile_ranges(image.shape[0], tile_size, halo):
+      for x0, x1, core_x0, core_x1 in tile_ranges(image.shape[1], tile_size, halo):
+         inside = np.flatnonzero((ys >= core_y0) & (ys < core_y1) & (xs >= core_x0) & (xs < core_x1))
+         if inside.size == 0:
+            continue
+         tile = read_tile(image, y0, y1, x0, x1)
+         feats[inside] = extract_features(tile, xs[inside] - x0, ys[inside] - y0, scale)
+   return feats
+
+"""
+   Interest points and feature descriptors of a large image, tile by tile.
+
+   Returns:
+      xs, ys, scores - output of find_interest_points_tiled()
+      feats          - output of extract_features_tiled()
+"""
+def image_features_tiled(image, max_points = 200, scale = 1.0, tile_size = 1024):
+   image = open_image(image)
+   xs, ys, scores = find_interest_points_tiled(image, max_points, scale, tile_size=tile_size)
+   feats = extract_features_tiled(image, xs, ys, scale, tile_size)
+   return xs, ys, scores, feats
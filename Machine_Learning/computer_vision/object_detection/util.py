@@ -1,5 +1,6 @@
 import numpy as np
 import imageio
+import scipy.io
 
 """
    Convert an RGB image to grayscale.
@@ -23,36 +24,121 @@ def rgb2gray(rgb):
 
    Arguments:
       filename - image file to load
+      dtype    - floating point type of the image (np.float32 or np.float64)
 
    Returns:
       image    - a 2D numpy array containing a grayscale image
 """
-def load_image(filename):
-   image = imageio.imread(filename)
-   image = image / 255;
+def load_image(filename, dtype = np.float64):
+   image = np.asarray(imageio.imread(filename), dtype=dtype)
+   image /= 255
    if (image.ndim == 3):
-      image = rgb2gray(image)
+      image = rgb2gray(image).astype(dtype, copy=False)
    return image
 
 """
-   Compute IOU (intersection of union) between two bounding boxes
+   Load a set of object templates from a .mat file (e.g. data_car.mat).
 
    Arguments:
-       boxA - a numpy array of shape (4,) specifying the bounding box
-              in the format (x_min, y_min, x_max, y_max)
-       boxB - a numpy array of shape (4,) specifying the bounding box
-              in the format (x_min, y_min, x_max, y_max)
+      filename        - .mat file with template_images and template_masks cells
+      dtype           - floating point type of the templates
 
    Returns:
-        iou - float number, intersection of union
+      template_images - a list of grayscale templates, scaled like load_image()
+      template_masks  - a list of the corresponding binary masks
+"""
+def load_templates(filename, dtype = np.float64):
+   data = scipy.io.loadmat(filename)
+   template_images = [np.asarray(image, dtype=dtype) / 255 for image in data['template_images'].ravel()]
+   template_masks = list(data['template_masks'].ravel())
+   return template_images, template_masks
+
+"""
+   Load an object detection dataset from a .mat file (e.g. data_car.mat).
+
+   Arguments:
+      filename        - .mat file with template_images, template_masks,
+                        test_images and test_images_target
+      dtype           - floating point type of the template and test images
+
+   Returns:
+      template_images - see load_templates()
+      template_masks  - see load_templates()
+      test_images     - a list of grayscale test images, scaled like load_image()
+      targets         - a numpy array of shape (N, 4) of ground truth boxes
+                        (x_min, y_min, x_max, y_max)
+"""
+def load_dataset(filename, dtype = np.float64):
+   template_images, template_masks = load_templates(filename, dtype)
+   data = scipy.io.loadmat(filename)
+   test_images = data['test_images']
+   if test_images.dtype == object:
+      test_images = test_images.ravel()
+   test_images = [np.asarray(image, dtype=dtype) / 255 for image in test_images]
+   return template_images, template_masks, test_images, data['test_images_target']
+
+"""
+   Compute IOU (intersection of union) between bounding boxes
+
+   Boxes are compared pairwise: the IoU of every box of boxA with every box
+   of boxB is computed at once.  Boxes of zero union get an IoU of 0.
+
+   Arguments:
+       boxA - a numpy array of shape (4,) or (N, 4) specifying bounding
+              boxes in the format (x_min, y_min, x_max, y_max)
+       boxB - a numpy array of shape (4,) or (M, 4) specifying bounding
+              boxes in the format (x_min, y_min, x_max, y_max)
+
+   Returns:
+        iou - float number for two single boxes, otherwise a numpy array of
+              shape (N, M), (N,) or (M,) of intersections of union
 """
 def compute_iou(boxA, boxB):
-    xA = max(boxA[0], boxB[0])
-    yA = max(boxA[1], boxB[1])
-    xB = min(boxA[2], boxB[2])
-    yB = min(boxA[3], boxB[3])
-    interArea = max(0, xB - xA + 1) * max(0, yB - yA + 1)
-    boxAArea = (boxA[2] - boxA[0] + 1) * (boxA[3] - boxA[1] + 1)
-    boxBArea = (boxB[2] - boxB[0] + 1) * (boxB[3] - boxB[1] + 1)
-    iou = interArea / float(boxAArea + boxBArea - interArea)
+    boxA = np.asarray(boxA, dtype=float)
+    boxB = np.asarray(boxB, dtype=float)
+    a = boxA.reshape(-1, 1, 4)
+    b = boxB.reshape(1, -1, 4)
+    xA = np.maximum(a[..., 0], b[..., 0])
+    yA = np.maximum(a[..., 1], b[..., 1])
+    xB = np.minimum(a[..., 2], b[..., 2])
+    yB = np.minimum(a[..., 3], b[..., 3])
+    interArea = np.maximum(0, xB - xA + 1) * np.maximum(0, yB - yA + 1)
+    boxAArea = (a[..., 2] - a[..., 0] + 1) * (a[..., 3] - a[..., 1] + 1)
+    boxBArea = (b[..., 2] - b[..., 0] + 1) * (b[..., 3] - b[..., 1] + 1)
+    union = boxAArea + boxBArea - interArea
+    iou = np.divide(interArea, union, out=np.zeros(union.shape), where=union!=0)
+    iou = iou.reshape(boxA.shape[:-1] + boxB.shape[:-1])
+    if iou.ndim == 0:
+        return float(iou)
     return iou
+
+"""
+   Greedy non-maximum suppression of bounding boxes
+
+   Boxes are visited from the highest to the lowest score; a box is kept
+   unless it overlaps an already kept box by more than iou_threshold.
+
+   Arguments:
+       boxes         - a numpy array of shape (N, 4) of bounding boxes in the
+                       format (x_min, y_min, x_max, y_max)
+       scores        - a numpy array of shape (N,) of box scores
+       iou_threshold - largest IoU allowed between two kept boxes
+       max_boxes     - (optional) maximum number of boxes to keep
+
+   Returns:
+        keep         - numpy array of the indices of the kept boxes, from the
+                       highest to the lowest score
+"""
+def box_nms(boxes, scores, iou_threshold = 0.5, max_boxes = None):
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    remaining = np.argsort(-np.asarray(scores, dtype=float), kind='stable')
+    keep = []
+    while remaining.size:
+        # Keep the best remaining box and drop the boxes it overlaps, so only
+        # one row of IoUs is held at a time
+        best, remaining = remaining[0], remaining[1:]
+        keep.append(best)
+        if max_boxes is not None and len(keep) >= max_boxes:
+            break
+        remaining = remaining[compute_iou(boxes[best], boxes[remaining]) <= iou_threshold]
+    return np.array(keep, dtype=int)
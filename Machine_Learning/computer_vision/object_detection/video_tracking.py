@@ -0,0 +1,175 @@
+import argparse
+import glob
+import json
+import sys
+import time
+import numpy as np
+
+from object_detection import build_template_index, image_features, locate_templates, peaks_to_bbox
+from util import load_image, load_templates
+
+"""
+   VIDEO TRACKING
+
+   Detects an object category in a stream of video frames, reusing the
+   translation found in previous frames.
+
+   The first frame is searched in full.  Every later frame is only searched
+   inside a region around the template positions predicted from the last
+   Hough translations and their frame-to-frame motion, so interest points,
+   descriptors and matching run on a fraction of the frame.  Templates without
+   votes in the region keep their predicted translation.
+
+   The confidence of a detection is the mean Hough peak weight over the
+   templates; when it falls below min_confidence times the confidence of the
+   last full-frame detection (e.g. the object moved faster than the margin
+   allows, or was occluded), the frame is searched in full again.
+"""
+
+"""
+   Region of a frame covering the templates placed at their peaks.  A peak is
+   the translation of a template, i.e. where its top-left corner lands.
+
+   Arguments:
+      index   - output of build_template_index()
+      peaks   - numpy array of shape (T, 3) of [ty, tx, weight] peaks; only
+                templates with a positive weight are covered
+      shape   - shape of the frame
+      margin  - pixels added on every side
+
+   Returns:
+      region  - (y0, y1, x0, x1) clipped to the frame, or None if no template
+                has a peak or the region does not overlap the frame
+"""
+def search_region(index, peaks, shape, margin):
+   found = peaks[:, 2] > 0
+   if not found.any():
+      return None
+   ty, tx = peaks[found, 0], peaks[found, 1]
+   template_y, template_x = index['shapes'][found, 0], index['shapes'][found, 1]
+   y0 = max(int(np.floor(np.min(ty))) - margin, 0)
+   x0 = max(int(np.floor(np.min(tx))) - margin, 0)
+   y1 = min(int(np.ceil(np.max(ty + template_y))) + margin + 1, shape[0])
+   x1 = min(int(np.ceil(np.max(tx + template_x))) + margin + 1, shape[1])
+   if y1 <= y0 or x1 <= x0:
+      return None
+   return y0, y1, x0, x1
+
+# Pixels read around a search region: the support of the Gaussian (3) and
+# Sobel (1) filters and of the largest descriptor patch (9 + 9 // 2), which
+# also covers the Harris window and non-max suppression
+REGION_HALO = 3 + 1 + 9 + 9 // 2
+
+"""
+   Locate the templates of an index in a region of a frame.
+
+   The region is read with a halo of REGION_HALO pixels, so that the Harris
+   responses and descriptors of the points inside it are those of the whole
+   frame and the edges of the crop do not show up as corners.
+
+   Returns:
+      peaks - output of locate_templates(), in frame coordinates
+"""
+def locate_in_region(index, frame, region, profile = None):
+   y0, y1, x0, x1 = region
+   halo_y0, halo_x0 = max(y0 - REGION_HALO, 0), max(x0 - REGION_HALO, 0)
+   halo_y1, halo_x1 = min(y1 + REGION_HALO, frame.shape[0]), min(x1 + REGION_HALO, frame.shape[1])
+   core = (y0 - halo_y0, y1 - halo_y0, x0 - halo_x0, x1 - halo_x0)
+   xs, ys, scores, feats = image_features(frame[halo_y0:halo_y1, halo_x0:halo_x1], profile=profile,
+                                          descriptor=index['descriptor'], region=core)
+   return locate_templates(index, xs + halo_x0, ys + halo_y0, scores, feats, profile)
+
+"""
+   Track an object category through a sequence of frames.
+
+   Arguments:
+      frames          - an iterable of grayscale frames (2D numpy arrays)
+      template_images - a list of gray scale template images
+      template_masks  - a list of binary masks of the template images
+      template_index  - (optional) output of build_template_index() to reuse
+      margin          - pixels searched around the predicted templates
+      min_confidence  - fraction of the confidence of the last full-frame
+                        detection below which a frame is searched in full
+      dtype           - (optional) floating point type to run the pipeline in
+      profile         - (optional) a profiling.DetectionProfile
+
+   Returns:
+      a generator of one dict per frame:
+         bbox       - (x_min, y_min, x_max, y_max)
+         confidence - mean Hough peak weight over the templates
+         full_frame - whether the whole frame was searched
+         seconds    - detection time of the frame
+"""
+def track_frames(frames, template_images, template_masks, template_index = None, margin = 32, min_confidence = 0.5, dtype = None, profile = None):
+   if template_index is None:
+      template_index = build_template_index(template_images, template_masks, dtype=dtype, profile=profile)
+
+   last = None
+   motion = np.zeros(2)
+   reference = 0.0
+   for frame in frames:
+      start = time.perf_counter()
+      if dtype is not None:
+         frame = np.asarray(frame, dtype=dtype)
+
+      # 1. Search around the templates predicted from the last translation and motion
+      peaks = None
+      if last is not None:
+         predicted = last.copy()
+         predicted[:, :2] += motion
+         region = search_region(template_index, predicted, frame.shape, margin)
+         if region is not None:
+            peaks = locate_in_region(template_index, frame, region, profile)
+            confidence = float(peaks[:, 2].mean())
+            if confidence == 0 or confidence < min_confidence * reference:
+               peaks = None
+
+      # 2. Fall back to the whole frame if there was no prediction or it was lost
+      full_frame = peaks is None
+      if full_frame:
+         peaks = locate_in_region(template_index, frame, (0, frame.shape[0], 0, frame.shape[1]), profile)
+         confidence = float(peaks[:, 2].mean())
+         reference = confidence
+         motion = np.zeros(2)
+      else:
+         # Templates without votes in the region keep their predicted translation
+         missing = peaks[:, 2] == 0
+         peaks[missing, :2] = predicted[missing, :2]
+
+         # Motion of the templates found in both frames
+         both = ~missing & (last[:, 2] > 0)
+         if both.any():
+            motion = (peaks[both, :2] - last[both, :2]).mean(axis=0)
+
+      last = peaks
+      bbox = peaks_to_bbox(template_index, peaks)
+      yield {
+         'bbox': tuple(float(value) for value in bbox),
+         'confidence': confidence,
+         'full_frame': full_frame,
+         'seconds': time.perf_counter() - start,
+      }
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Track an object category through video frames')
+   parser.add_argument('templates', help='.mat file with template_images and template_masks')
+   parser.add_argument('frames', nargs='+', help='frame images or glob patterns, in playback order')
+   parser.add_argument('--margin', type=int, default=32, help='pixels searched around the predicted templates')
+   parser.add_argument('--min-confidence', type=float, default=0.5, help='relative confidence below which a frame is searched in full')
+   parser.add_argument('--output', default=None, help='JSON lines output file (default: stdout)')
+   args = parser.parse_args()
+
+   template_images, template_masks = load_templates(args.templates)
+   filenames = [name for pattern in args.frames for name in (sorted(glob.glob(pattern)) or [pattern])]
+   frames = (load_image(filename) for filename in filenames)
+
+   output = open(args.output, 'w') if args.output else sys.stdout
+   try:
+      tracks = track_frames(frames, template_images, template_masks, margin=args.margin, min_confidence=args.min_confidence)
+      for filename, track in zip(filenames, tracks):
+         output.write(json.dumps(dict(frame=filename, **track)) + '\n')
+         output.flush()
+   finally:
+      if output is not sys.stdout:
+         output.close()